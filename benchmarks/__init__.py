@@ -0,0 +1,12 @@
+"""
+=============================================
+uninja benchmarks
+=============================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Configure-time benchmark suite (see suite.py), run with:
+
+    PYTHONPATH=src python -m benchmarks --help
+"""
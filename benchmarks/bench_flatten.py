@@ -0,0 +1,86 @@
+"""
+=====================================================
+Benchmark: flattening of a deep, diamond-heavy graph
+=====================================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Builds a chain of targets much deeper than the recursion limit, where each
+target depends on the two previous ones (so each step is a diamond), and
+on a few shared ones through implicit dependencies. Times
+uninja.output.flatten on it, and checks that each target is written
+exactly once, after all its dependencies (exits with an error otherwise).
+
+Run with: PYTHONPATH=src python -m benchmarks.bench_flatten [depth] [nshared]
+"""
+
+import sys
+import time
+
+from uninja        import Rule, Target
+from uninja.output import flatten
+
+
+def diamond_chain(depth: int, nshared: int = 16):
+    """
+    Returns the last target of the chain, and the number of targets.
+    """
+
+    rule   = Rule(name="cc", command="cc $in -o $out")
+    shared = [Target(name=f"shared_{i}", rule=rule, deps=(f"shared_{i}.c",)) for i in range(nshared)]
+
+    prev = (Target(name="chain_0", rule=rule, deps=("chain_0.c",)),)
+    for i in range(1, depth):
+        tt   = Target(
+            name     = f"chain_{i}",
+            rule     = rule,
+            deps     = prev + (f"chain_{i}.c",),
+            implicit = (shared[i % nshared],)
+        )
+        prev = (tt, prev[0])
+
+    return prev[0], depth + nshared
+
+
+def check(ss, count: int) -> bool:
+    """
+    True if the flattened targets are count distinct targets, each one
+    after its dependencies and implicit dependencies.
+    """
+
+    if len(ss) != count:
+        return False
+
+    seen = set()
+    for tt, _ in ss.values():
+        if tt.name in seen:
+            return False
+        for dep in tuple(tt.deps) + tuple(tt.implicit):
+            if isinstance(dep, Target) and dep.name not in seen:
+                return False
+        seen.add(tt.name)
+
+    return True
+
+
+def run(depth: int = 100000, nshared: int = 16):
+    root, count = diamond_chain(depth, nshared)
+    print(f"{count} targets, chain depth {depth}, recursion limit {sys.getrecursionlimit()}")
+
+    ok = True
+    for canonical in (False, True):
+        t0     = time.perf_counter()
+        ss, _  = flatten((root,), canonical=canonical)
+        t      = time.perf_counter() - t0
+        result = check(ss, count)
+        ok     = ok and result
+
+        print(f"  canonical={canonical!s:5s}: {t:8.3f} s, each target once after its dependencies: {result}")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run(*map(int, sys.argv[1:]))
@@ -0,0 +1,134 @@
+"""
+=====================================================
+Benchmark: memory of Target objects vs CompactGraph
+=====================================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Processes a synthetic workspace (see workspace.py) with ToolchainGCC, and
+measures (tracemalloc) the configure peak memory when returning Target
+objects and when filling a CompactGraph (Toolchain.graph), then the memory
+retained by the Target objects, and by the same graph once they are
+released. Also times the ninja output of both, and checks that the single
+file and sharded outputs are the same (exits with an error otherwise).
+
+Run with: PYTHONPATH=src python -m benchmarks.bench_graph [ncomps] [nsrcs]
+"""
+
+import gc
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pathlib                import Path
+from typing                 import Dict
+
+from uninja.codebase        import c as c_code
+from uninja.graph           import CompactGraph
+from uninja.output          import digest, write_sharded
+from uninja.toolchain.base  import Toolchain
+from uninja.toolchain.c.gcc import ToolchainGCC
+
+from .workspace             import workspace
+
+
+def traced():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def peak(fn):
+    """
+    Returns the result of fn, and the peak memory it allocated.
+    """
+
+    gc.collect()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    return result, tracemalloc.get_traced_memory()[1] - before
+
+
+def process(nodes, graph=None):
+    tools = Toolchain(root_dir=Path.cwd(), build_dir=Path("build"), graph=graph)
+    ToolchainGCC().associate_to(tools)
+    return tools.process_many(nodes)
+
+
+def sharded(shards) -> Dict[str, str]:
+    """
+    Content of the files written by write_sharded, by path relative to the
+    output directory.
+    """
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_sharded(Path(tmp) / "build.ninja", shards)
+        return {str(x.relative_to(tmp)): x.read_text() for x in sorted(Path(tmp).rglob("*.ninja"))}
+
+
+def run(ncomps: int = 400, nsrcs: int = 20):
+    nodes = c_code.components_closure(workspace(ncomps, nsrcs))
+    print(f"{ncomps} components, {nsrcs} sources each")
+
+    # Configure peak memory, returning targets or filling a graph
+    tracemalloc.start()
+
+    live            = CompactGraph()
+    _, peak_targets = peak(lambda: process(nodes))
+    _, peak_live    = peak(lambda: process(nodes, live))
+
+    tracemalloc.stop()
+
+    print(f"  Configure peak, Target objects: {peak_targets / 2**20:8.2f} MiB")
+    print(f"  Configure peak, CompactGraph:   {peak_live    / 2**20:8.2f} MiB")
+
+    # Memory: the graph replaces the targets, which are released
+    tracemalloc.start()
+
+    base        = traced()
+    targets     = process(nodes)
+    mem_targets = traced() - base
+
+    graph       = CompactGraph.from_targets(targets, canonical=True)
+    del targets
+    mem_graph   = traced() - base
+
+    tracemalloc.stop()
+
+    print(f"  Target objects: {mem_targets / 2**20:8.2f} MiB")
+    print(f"  CompactGraph:   {mem_graph   / 2**20:8.2f} MiB ({len(graph)} targets, {len(graph.strings)} strings)")
+
+    # Output
+    targets     = process(nodes)
+
+    t0          = time.perf_counter()
+    ref         = digest(targets)
+    t_targets   = time.perf_counter() - t0
+
+    t0          = time.perf_counter()
+    result      = digest(graph)
+    t_graph     = time.perf_counter() - t0
+
+    print(f"  Output from targets: {t_targets:8.3f} s, from graph: {t_graph:8.3f} s, same output: {ref == result}")
+
+    # Graph filled while configuring, in processing order
+    memo      = dict()
+    same_live = digest([view.to_target(memo) for view in live]) == ref
+
+    print(f"  Graph filled while configuring, same output: {same_live}")
+
+    # Sharded output: the second shard skips the targets of the first one
+    low         = process(nodes[:len(nodes) // 2])
+    same_shards = sharded({"low": low, "all": targets}) \
+        == sharded({"low": CompactGraph.from_targets(low, canonical=True), "all": graph})
+
+    print(f"  Sharded output from graph, same output: {same_shards}")
+
+    if ref != result or not same_live or not same_shards:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run(*map(int, sys.argv[1:]))
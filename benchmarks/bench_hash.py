@@ -0,0 +1,67 @@
+"""
+==================================================
+Micro-benchmark: hashing of codebase model objects
+==================================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Measures set and dict throughput on the components of a synthetic
+workspace (see workspace.py) of depth layers of width components, each
+depending on width components of the lower layers, with the cached hash
+and with the hash generated by the dataclass (uncached).
+
+Run with: PYTHONPATH=src python -m benchmarks.bench_hash [depth] [width] [srcs]
+"""
+
+import sys
+import timeit
+
+from contextlib        import contextmanager, nullcontext
+
+from uninja.codebase   import c as c_code
+
+from .workspace        import workspace
+
+CACHED_CLASSES = (c_code.Component, c_code.Source, c_code.Executable, c_code.StaticLib)
+
+
+@contextmanager
+def uncached():
+    """
+    Temporarily restores the hash generated by the dataclasses
+    """
+
+    saved = {cls: cls.__hash__ for cls in CACHED_CLASSES}
+    try:
+        for cls in CACHED_CLASSES:
+            cls.__hash__ = cls.__hash__.__wrapped__
+        yield
+    finally:
+        for cls, fn in saved.items():
+            cls.__hash__ = fn
+
+
+def run(depth: int = 6, width: int = 3, nsrcs: int = 20, number: int = 5):
+    nodes = c_code.components_closure(workspace(ncomps=depth * width, nsrcs=nsrcs, fan_in=width, nlayers=depth))
+    comps = [x for x in nodes if isinstance(x, c_code.Component)]
+    table = {c: i for i, c in enumerate(comps)}
+
+    def build_set():
+        return set(comps)
+
+    def lookup_dict():
+        for c in comps:
+            table[c]
+
+    print(f"{len(comps)} components, depth={depth}, width={width}, {nsrcs} sources each")
+
+    for mode in ("cached", "uncached"):
+        with (uncached() if mode == "uncached" else nullcontext()):
+            for name, fn in (("set build", build_set), ("dict lookup", lookup_dict)):
+                t = timeit.timeit(fn, number=number) / number
+                print(f"  {mode:8s} {name:11s}: {t*1e3:10.3f} ms/iter, {len(comps)/t:12.0f} ops/s")
+
+
+if __name__ == "__main__":
+    run(*map(int, sys.argv[1:]))
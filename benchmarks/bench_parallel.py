@@ -0,0 +1,54 @@
+"""
+=====================================================
+Benchmark: parallel processing of the codebase model
+=====================================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Processes a synthetic workspace (see workspace.py) with ToolchainGCC, sequentially and with
+Toolchain.process_many for an increasing number of workers, and checks
+that the generated build file is the same.
+
+Run with: PYTHONPATH=src python -m benchmarks.bench_parallel [ncomps] [nsrcs] [max_workers]
+"""
+
+import os
+import sys
+import time
+
+from pathlib                import Path
+
+from uninja.codebase        import c as c_code
+from uninja.output          import digest
+from uninja.toolchain.base  import Toolchain
+from uninja.toolchain.c.gcc import ToolchainGCC
+
+from .workspace              import workspace
+
+
+def run(ncomps: int = 400, nsrcs: int = 20, max_workers: int = os.cpu_count() or 1):
+    nodes = c_code.components_closure(workspace(ncomps, nsrcs))
+
+    print(f"{ncomps} components, {nsrcs} sources each, {os.cpu_count()} cpus")
+
+    workers   = 1
+    reference = None
+    while workers <= max_workers:
+        tools = Toolchain(root_dir=Path.cwd(), build_dir=Path("build"))
+        ToolchainGCC().associate_to(tools)
+
+        t0      = time.perf_counter()
+        targets = tools.process_many(nodes, workers=workers)
+        t       = time.perf_counter() - t0
+
+        result    = digest(targets)
+        reference = reference or result
+        t_ref     = t if workers == 1 else t_ref
+
+        print(f"  workers={workers:3d}: {t:8.3f} s, speedup {t_ref/t:5.2f}, same output: {result == reference}")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    run(*map(int, sys.argv[1:]))
@@ -0,0 +1,74 @@
+"""
+==================================================
+Micro-benchmark: target variables in a configure
+==================================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Simulates a vars-heavy configure: each object target gets base variables,
+then flags are layered over them (lookups, overrides and appends), and the
+targets are put in a set. Compares TargetVars with the previous storage (a
+frozenset of TargetVar rebuilt for each change, with linear lookups).
+
+Run with: PYTHONPATH=src python -m benchmarks.bench_vars [ntargets] [nvars] [nlayers]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from uninja.target import TargetVar, TargetVars
+
+
+def legacy_get(values, key):
+    return next((x.value for x in values if x.key == key), None)
+
+
+def legacy_with_var(values, key, value):
+    return frozenset({x for x in values if x.key != key} | {TargetVar(key, value)})
+
+
+def configure_legacy(ntargets: int, nvars: int, nlayers: int):
+    result = set()
+    for i in range(ntargets):
+        values = frozenset(TargetVar(f"var{k}", f"-DVALUE_{k}={i % 97}") for k in range(nvars))
+        for layer in range(nlayers):
+            key    = f"var{layer % nvars}"
+            values = legacy_with_var(values, key, f"{legacy_get(values, key)} -DLAYER_{layer}")
+            values = legacy_with_var(values, f"layer{layer}", "1")
+        result.add(values)
+    return result
+
+
+def configure(ntargets: int, nvars: int, nlayers: int):
+    result = set()
+    for i in range(ntargets):
+        values = TargetVars({f"var{k}": f"-DVALUE_{k}={i % 97}" for k in range(nvars)})
+        for layer in range(nlayers):
+            values = values.appending(f"var{layer % nvars}", f"-DLAYER_{layer}")
+            values = values.with_var(f"layer{layer}", "1")
+        result.add(values)
+    return result
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    t0     = time.perf_counter()
+    result = fn(*args)
+    t      = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return t, peak, len(result)
+
+
+def run(ntargets: int = 20000, nvars: int = 4, nlayers: int = 4):
+    print(f"{ntargets} targets, {nvars} variables, {nlayers} layers")
+    for name, fn in (("frozenset of TargetVar", configure_legacy), ("TargetVars", configure)):
+        t, peak, count = measure(fn, ntargets, nvars, nlayers)
+        print(f"  {name:24s}: {t:8.3f} s, peak {peak / 2**20:8.2f} MiB, {count} distinct")
+
+
+if __name__ == "__main__":
+    run(*map(int, sys.argv[1:]))
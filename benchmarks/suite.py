@@ -0,0 +1,208 @@
+"""
+=============================================
+Configure-time benchmark suite
+=============================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Measures, on a synthetic workspace (see workspace.py), the wall time, the
+peak memory (tracemalloc) and the output size of:
+
+- Toolchain.process with ToolchainGCC and with ToolchainClangTidy,
+- uninja.output.build_file of the resulting targets.
+
+Wall time is measured without tracemalloc, which slows down allocations,
+and the best of the repeats is kept. Results are written as JSON, and two
+result files can be compared:
+
+    PYTHONPATH=src python -m benchmarks --comps 400 --srcs 20 -o new.json
+    PYTHONPATH=src python -m benchmarks --compare old.json new.json
+"""
+
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from pathlib                       import Path
+from typing                        import Callable, Dict, List, Optional
+
+from uninja.codebase               import c as c_code
+from uninja.output                 import build_file
+from uninja.toolchain.base         import Toolchain
+from uninja.toolchain.c.gcc        import ToolchainGCC
+from uninja.toolchain.c.clang_tidy import ToolchainClangTidy
+
+from .workspace                    import workspace
+
+# Results format, bumped when the meaning of the results changes
+RESULTS_VERSION = 1
+
+
+class _Counter:
+    """
+    File-like object counting the bytes written to it
+    """
+
+    name = "<counter>"
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, text: str):
+        self.size += len(text.encode("utf-8"))
+
+
+def measure(fn: Callable, repeat: int = 3) -> Dict:
+    """
+    Runs fn repeat times for the wall time, then once under tracemalloc for
+    the peak memory. fn returns a dict of extra values, added to the result.
+    """
+
+    best  = None
+    extra = dict()
+    for _ in range(repeat):
+        gc.collect()
+        t0    = time.perf_counter()
+        extra = fn()
+        t     = time.perf_counter() - t0
+        best  = t if best is None else min(best, t)
+
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"wall_s": best, "peak_bytes": peak, **extra}
+
+
+def _process(nodes, toolchain):
+    tools = Toolchain(root_dir=Path.cwd(), build_dir=Path.cwd() / "build")
+    toolchain.associate_to(tools)
+    return tools.process_many(nodes, workers=1)
+
+
+def run(
+    ncomps: int = 200,
+    nsrcs: int = 20,
+    fan_in: int = 3,
+    fan_out: Optional[int] = None,
+    diamond: float = 0.5,
+    nlayers: int = 4,
+    nexes: int = 1,
+    repeat: int = 3
+) -> Dict:
+    params = dict(ncomps=ncomps, nsrcs=nsrcs, fan_in=fan_in, fan_out=fan_out, diamond=diamond, nlayers=nlayers, nexes=nexes)
+    nodes  = c_code.components_closure(workspace(**params))
+
+    toolchains = {
+        "gcc":        ToolchainGCC,
+        "clang-tidy": ToolchainClangTidy,
+    }
+
+    results = []
+    for name, toolchain in toolchains.items():
+        targets = _process(nodes, toolchain())
+
+        results.append({"name": f"process/{name}", **measure(
+            lambda: {"targets": len(_process(nodes, toolchain()))},
+            repeat
+        )})
+
+        def output():
+            counter = _Counter()
+            build_file(counter, targets, canonical=True)
+            return {"output_bytes": counter.size}
+
+        results.append({"name": f"build_file/{name}", **measure(output, repeat)})
+
+    return {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "python":   platform.python_version(),
+            "platform": platform.platform(),
+            "commit":   _git_commit(),
+            "time":     time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "params":  params,
+        "results": results,
+    }
+
+
+def compare(old: Dict, new: Dict) -> List[str]:
+    """
+    Lines comparing two results of run(), by benchmark name
+    """
+
+    lines = []
+    if old.get("params") != new.get("params"):
+        lines.append(f"Warning: different parameters: {old.get('params')} / {new.get('params')}")
+
+    before = {x["name"]: x for x in old["results"]}
+    for result in new["results"]:
+        ref = before.get(result["name"])
+        if ref is None:
+            continue
+
+        changes = []
+        for key in ("wall_s", "peak_bytes", "output_bytes"):
+            if key in result and ref.get(key):
+                changes.append(f"{key} {result[key] / ref[key] - 1:+7.1%}")
+        lines.append(f"{result['name']:24s} " + ", ".join(changes))
+
+    return lines
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ("git", "rev-parse", "HEAD"), check=True, universal_newlines=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="uninja configure-time benchmarks")
+    parser.add_argument("--comps",   type=int,   default=200,  help="number of components")
+    parser.add_argument("--srcs",    type=int,   default=20,   help="number of sources per component")
+    parser.add_argument("--fan-in",  type=int,   default=3,    help="dependencies of each component")
+    parser.add_argument("--fan-out", type=int,   default=None, help="maximum number of dependents of a component")
+    parser.add_argument("--diamond", type=float, default=0.5,  help="diamond density, between 0 and 1")
+    parser.add_argument("--layers",  type=int,   default=4,    help="number of component layers")
+    parser.add_argument("--exes",    type=int,   default=1,    help="number of executables")
+    parser.add_argument("--repeat",  type=int,   default=3,    help="runs per benchmark, the best time is kept")
+    parser.add_argument("-o", "--output", type=Path, default=None, help="JSON results file, default is stdout")
+    parser.add_argument("--compare", type=Path, nargs=2, metavar=("OLD", "NEW"), help="compare two results files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        old, new = (json.loads(x.read_text()) for x in args.compare)
+        print("\n".join(compare(old, new)))
+        return
+
+    results = run(
+        ncomps  = args.comps,
+        nsrcs   = args.srcs,
+        fan_in  = args.fan_in,
+        fan_out = args.fan_out,
+        diamond = args.diamond,
+        nlayers = args.layers,
+        nexes   = args.exes,
+        repeat  = args.repeat
+    )
+
+    text = json.dumps(results, indent=2) + "\n"
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        args.output.write_text(text)
+        for result in results["results"]:
+            print(f"{result['name']:24s} {result['wall_s']:8.3f} s, peak {result['peak_bytes'] / 2**20:8.2f} MiB")
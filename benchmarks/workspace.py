@@ -0,0 +1,92 @@
+"""
+=============================================
+Synthetic C workspaces for the benchmarks
+=============================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Generates uninja.codebase.c workspaces of any size. Generation is
+deterministic for a given seed, so that results can be compared between
+commits.
+"""
+
+import random
+
+from pathlib         import Path
+from typing          import Optional, Tuple
+
+from uninja.codebase import c as c_code
+
+
+def workspace(
+    ncomps: int = 100,
+    nsrcs: int = 10,
+    fan_in: int = 3,
+    fan_out: Optional[int] = None,
+    diamond: float = 0.5,
+    nlayers: int = 4,
+    nexes: int = 1,
+    seed: int = 42
+) -> Tuple[c_code.Executable]:
+    """
+    Creates ncomps components of nsrcs sources each, spread over nlayers layers,
+    and nexes executables sharing the components no other component depends on.
+
+    - fan_in is the number of components each component depends on, taken in
+      the previous layers,
+    - fan_out is the maximum number of components depending on a component
+      (None for no limit),
+    - diamond is the probability, for each dependency, to pick a component
+      already reachable through another dependency (or a dependency of it),
+      which creates diamonds in the graph (0 gives mostly trees, 1 mostly
+      diamonds).
+    """
+
+    rng        = random.Random(seed)
+    layers     = [[] for _ in range(nlayers)]
+    dependents = dict() # Component -> number of components depending on it
+
+    for i in range(ncomps):
+        layer      = i * nlayers // ncomps
+        candidates = [
+            c for lower in layers[:layer] for c in lower
+            if fan_out is None or dependents[c] < fan_out
+        ]
+
+        deps  = []
+        reach = set()
+        while candidates and len(deps) < fan_in:
+            shared = [c for c in candidates if c in reach]
+            pool   = shared if shared and rng.random() < diamond else candidates
+            dep    = rng.choice(pool)
+
+            candidates.remove(dep)
+            deps.append(dep)
+            reach.add(dep)
+            reach.update(dep.components_dependencies)
+
+        comp = c_code.add_component(
+            name = f"comp_{i}",
+            path = Path(f"src/comp_{i}"),
+            srcs = {f"src_{j}.c" for j in range(nsrcs)},
+
+            defines                 = {("COMP_ID", str(i))},
+            interface_directories   = {"include"},
+            components_dependencies = deps
+        )
+
+        for dep in deps:
+            dependents[dep] += 1
+        dependents[comp] = 0
+        layers[layer].append(comp)
+
+    roots = [c for layer in layers for c in layer if dependents[c] == 0]
+    return tuple(
+        c_code.add_executable(
+            name       = f"bin/main_{i}",
+            srcs       = {c_code.add_source(f"src/main_{i}.c")},
+            components = roots[i::nexes] or roots
+        )
+        for i in range(nexes)
+    )
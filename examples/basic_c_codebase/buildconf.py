@@ -8,7 +8,7 @@ from uninja.codebase.c.component  import Component
 from uninja.codebase.c.executable import Executable
 
 from uninja.rule                  import Rule, Phony
-from uninja.target                import Target, TargetVar, TargetVars
+from uninja.target                import Target, TargetVar, TargetVars, TargetGraph
 
 from uninja.toolchain.base        import Toolchain
 
@@ -85,8 +85,8 @@ def check_process_component(tools: Toolchain, comp: Component):
     #tools.log.debug(f" -- Component sources: {[x.path for x in comp.srcs]}")
 
 
-    targets_srcs       = tuple()
-    targets_comp       = tuple()
+    targets_srcs       = TargetGraph()
+    targets_comp       = TargetGraph()
     components_incdirs = set()
 
     # Process components dependencies
@@ -111,10 +111,10 @@ def check_process_component(tools: Toolchain, comp: Component):
     target_component = Target(
         name = f"ctidy-component/{comp.path}/{comp.name}.lock",
         rule = RULE_TOUCH_AFTER, # Touch the lock file when all sources checked correctly
-        deps = targets_srcs
+        deps = targets_srcs.freeze()
     )
 
-    return targets_comp + (target_component,)
+    return targets_comp.freeze() + (target_component,)
 
 
 def check_process_executable(tools: Toolchain, exe: Executable):
@@ -122,7 +122,7 @@ def check_process_executable(tools: Toolchain, exe: Executable):
     #tools.log.info(f" -- Executable sources:    {[x.path for x in exe.srcs]}")
     #tools.log.info(f" -- Executable components: {[x.name for x in exe.components]}")
     
-    targets = tuple()
+    targets = TargetGraph()
 
     # Process sources
     for src in exe.srcs:
@@ -133,7 +133,7 @@ def check_process_executable(tools: Toolchain, exe: Executable):
         tools.log.info(f" --> Configure component: {comp.name}")
         targets += tools.process(comp)
 
-    return targets
+    return targets.freeze()
 
 
 ######################################
@@ -163,8 +163,8 @@ def gcc_process_component(tools: Toolchain, comp: Component):
     tools.log.info(f"Add component: {comp.name}")
     tools.log.debug(f" -- Path: {comp.path}")
 
-    targets_srcs       = tuple()
-    targets_comp       = tuple()
+    targets_srcs       = TargetGraph()
+    targets_comp       = TargetGraph()
     components_incdirs = set()
 
     # Process components
@@ -194,15 +194,15 @@ def gcc_process_component(tools: Toolchain, comp: Component):
     target_lib = Target(
         name = f"component/{comp.name}.a",
         rule = RULE_LIB,
-        deps = targets_srcs
+        deps = targets_srcs.freeze()
     )
 
-    return (target_lib,) + targets_comp
+    return (target_lib,) + targets_comp.freeze()
 
 def gcc_process_executable(tools: Toolchain, exe: Executable):
     tools.log.info(f"Add executable: {exe.name}")
 
-    targets            = tuple()
+    targets            = TargetGraph()
     components_incdirs = set()
 
     # Process components
@@ -228,7 +228,7 @@ def gcc_process_executable(tools: Toolchain, exe: Executable):
     target_exe = Target(
         name = exe.name,
         rule = RULE_LD,
-        deps = targets
+        deps = targets.freeze()
     )
 
     return (target_exe,)
@@ -16,8 +16,6 @@ log = logging.getLogger("project config")
 # Project configuration
 ################################
 
-from functools      import reduce
-
 from conf.toolchain import tools_build, tools_check
 from workspace      import export as main_targets
 
@@ -26,24 +24,32 @@ from workspace      import export as main_targets
 # Process targets
 ################################
 
-targets = reduce(
-    lambda a,b: a+b,
-    map(tools_build.process, main_targets)
-)
+targets       = uninja.TargetGraph()
+targets_check = uninja.TargetGraph()
+
+for node in main_targets:
+    targets       += tools_build.process(node)
+    targets_check += tools_check.process(node)
+
+
+################################
+# Regenerate ninja files when configuration changes
+################################
+
+from uninja.generator import regen_target
 
-targets_check = reduce(
-    lambda a,b: a+b,
-    map(tools_check.process, main_targets)
-)
+targets.add      (regen_target("build.ninja"))
+targets_check.add(regen_target("check.ninja"))
 
 
 ################################
 # Save to output file
 ################################
 tools_build.build_dir.mkdir(exist_ok=True)
-with open(f"{tools_build.build_dir}/build.ninja", "w") as fhandle:
-    uninja.output(fhandle, targets)
+uninja.output_file(tools_build.build_dir / "build.ninja", targets, canonical=True,
+                   compdb=tools_build.build_dir / "compile_commands.json")
 
 tools_check.build_dir.mkdir(exist_ok=True)
-with open(f"{tools_check.build_dir}/check.ninja", "w") as fhandle:
-    uninja.output(fhandle, targets_check)
\ No newline at end of file
+uninja.output_file(tools_check.build_dir / "check.ninja", targets_check, canonical=True)
+
+tools_build.configure_cache.save()
\ No newline at end of file
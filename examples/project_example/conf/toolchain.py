@@ -10,6 +10,7 @@ Toolchain configuration for example project
 from pathlib                       import Path
 
 from uninja.toolchain.base         import Toolchain
+from uninja.toolchain.cache        import ConfigureCache
 from uninja.toolchain.c.gcc        import ToolchainGCC
 from uninja.toolchain.c.clang_tidy import ToolchainClangTidy
 
@@ -47,8 +48,10 @@ class CustomToolchain(ToolchainGCC):
 # Toolchain instanciation
 ################################
 
-tools_build = Toolchain(root_dir=conf.dirs.project_dir, build_dir=conf.dirs.build_dir)
-tools_check = Toolchain(root_dir=conf.dirs.project_dir, build_dir=conf.dirs.build_dir)
+configure_cache = ConfigureCache(conf.dirs.build_dir / "configure.cache")
+
+tools_build = Toolchain(root_dir=conf.dirs.project_dir, build_dir=conf.dirs.build_dir, configure_cache=configure_cache)
+tools_check = Toolchain(root_dir=conf.dirs.project_dir, build_dir=conf.dirs.build_dir, configure_cache=configure_cache)
 
 gcc = CustomToolchain()
 gcc.associate_to(tools_build)
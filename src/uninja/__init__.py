@@ -13,6 +13,7 @@ See the LICENSE file for licensing info for this specific part
 # Some handy imports
 ##########################################
 
-from .target import Target, TargetVar, TargetVars
+from .target import Target, TargetVar, TargetVars, TargetGraph
 from .rule   import Rule, Phony
-from .output import build_file as output
\ No newline at end of file
+from .pool   import Pool, Console
+from .output import build_file as output, write_file as output_file
\ No newline at end of file
@@ -82,12 +82,14 @@ def add_component(
     defines                 = {},
     interface_directories   = {},
     components_dependencies = {},
+    pch                     = None,
 
     node_type = Component
 ):
     # Convert arguments
     name                    = str(name)
     path                    = Path(path)
+    pch                     = Path(pch) if pch is not None else None
 
     interface_directories   = frozenset(map(Path, interface_directories))
     components_dependencies = frozenset(components_dependencies)
@@ -118,7 +120,8 @@ def add_component(
         srcs                    = srcs,
         defines                 = defines,
         interface_directories   = interface_directories,
-        components_dependencies = components_dependencies
+        components_dependencies = components_dependencies,
+        pch                     = pch
     )
 
 def add_executable(
@@ -158,4 +161,33 @@ def add_static_lib(
         name       = name,
         srcs       = srcs,
         components = components
-    )
\ No newline at end of file
+    )
+
+
+#######################################################
+# Helper functions to walk a C Codebase
+#######################################################
+
+def components_closure(nodes):
+    """
+    Returns the given nodes, along with all the components they depend on
+    (directly or not), dependencies first.
+    """
+
+    result  = dict()
+    visited = set()
+    stack   = [(x, False) for x in reversed(tuple(nodes))]
+
+    while stack:
+        x, expanded = stack.pop()
+
+        if expanded:
+            result[x] = None
+        elif x not in visited:
+            visited.add(x)
+            stack.append((x, True))
+
+            deps = x.components_dependencies if isinstance(x, Component) else getattr(x, "components", frozenset())
+            stack.extend((dep, False) for dep in sorted(deps, key=lambda c: c.name, reverse=True))
+
+    return tuple(result)
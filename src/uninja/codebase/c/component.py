@@ -11,9 +11,11 @@ from dataclasses import dataclass, field
 from pathlib     import Path
 from typing      import FrozenSet, Optional
 
-from .source     import Source
-from .define     import Define
+from .source          import Source
+from .define          import Define
+from ...utils.hashing import cached_hash
 
+@cached_hash
 @dataclass(eq=True, frozen=True)
 class Component:
     name: str
@@ -31,4 +33,8 @@ class Component:
     interface_directories: FrozenSet[Path] = field(default_factory=frozenset)
 
     # List of component dependencies (libs, etc.)
-    components_dependencies: FrozenSet["Component"] = field(default_factory=frozenset)
\ No newline at end of file
+    components_dependencies: FrozenSet["Component"] = field(default_factory=frozenset)
+
+    # Header to precompile for the component sources, relative to
+    # the path of the component.
+    pch: Optional[Path] = None
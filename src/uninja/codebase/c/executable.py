@@ -10,9 +10,11 @@ Represents a target executable file
 from dataclasses import dataclass, field
 from typing      import FrozenSet
 
-from .component import Component
-from .source    import Source
+from .component       import Component
+from .source          import Source
+from ...utils.hashing import cached_hash
 
+@cached_hash
 @dataclass(eq=True, frozen=True)
 class Executable:
     name: str
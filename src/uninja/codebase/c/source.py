@@ -13,7 +13,8 @@ from enum import Enum
 
 from typing import FrozenSet, Optional
 
-from .define import Define
+from .define          import Define
+from ...utils.hashing import cached_hash
 
 class SourceLang(Enum):
     C      = "c",
@@ -21,6 +22,7 @@ class SourceLang(Enum):
     ASM    = "asm"
 
 
+@cached_hash
 @dataclass(eq=True, frozen=True)
 class Source:
     """
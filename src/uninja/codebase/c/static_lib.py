@@ -9,9 +9,11 @@ Model definition for a C static library
 from dataclasses import dataclass, field
 from typing      import FrozenSet
 
-from .component import Component
-from .source    import Source
+from .component       import Component
+from .source          import Source
+from ...utils.hashing import cached_hash
 
+@cached_hash
 @dataclass(eq=True, frozen=True)
 class StaticLib:
     name: str
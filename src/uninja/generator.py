@@ -0,0 +1,88 @@
+"""
+======================================
+Self-regenerating ninja file helpers
+======================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+"""
+
+import shlex
+import sys
+import sysconfig
+
+from pathlib     import Path
+from typing      import Optional, Sequence, Tuple
+
+from .target     import Target
+from .rule       import Rule
+
+
+def python_sources() -> Tuple[Path]:
+    """
+    Returns the sorted python source files of all the modules imported so far,
+    standard library excepted: the configure script, the project configuration
+    modules, uninja itself, etc.
+    """
+
+    stdlib = tuple(
+        Path(sysconfig.get_paths()[x]).resolve()
+        for x in ("stdlib", "platstdlib")
+    )
+
+    srcs = set()
+    for module in tuple(sys.modules.values()):
+        fname = getattr(module, "__file__", None)
+        if fname is None or not fname.endswith(".py"):
+            continue
+
+        path = Path(fname).resolve()
+        if any(path.is_relative_to(x) for x in stdlib):
+            continue
+
+        srcs.add(path)
+
+    return tuple(sorted(srcs))
+
+
+def regen_target(
+    output: str = "build.ninja",
+    command: Optional[str] = None,
+    deps: Optional[Sequence[Path]] = None
+) -> Target:
+    """
+    Creates the target regenerating the ninja file output (as seen from the
+    directory where ninja runs), so that ninja runs the configure step again
+    only when one of the python files used to configure changed.
+
+    Must be called at the end of the configuration, once every module is imported.
+
+    :param output: Name of the ninja file,
+    :param command: Configure command, default runs again the current script
+                    with the same arguments, in the current directory,
+    :param deps: Files the configuration depends on, default is python_sources().
+    """
+
+    if command is None:
+        command = f"cd {shlex.quote(str(Path.cwd()))} && " + " ".join(
+            map(shlex.quote, (sys.executable, *sys.argv))
+        )
+
+    if deps is None:
+        deps = python_sources()
+
+    # restat: when configure does not change the output file (see
+    # uninja.output_file), ninja must not consider it dirty again.
+    rule = Rule(
+        name        = "regen",
+        description = "Regenerating $out...",
+        command     = command,
+        generator   = True,
+        restat      = True
+    )
+
+    return Target(
+        name = output,
+        rule = rule,
+        deps = tuple(deps)
+    )
@@ -0,0 +1,390 @@
+"""
+=================================
+Compact storage of a target graph
+=================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Target objects are convenient for toolchains, but each of them costs a
+dataclass instance, a tuple of children, and a TargetVars mapping. For
+very large builds, CompactGraph stores the same graph in
+arrays:
+
+- target and file names are interned, each node is an integer id,
+- the rule, pool and dependencies of each target (a row) are ids, the
+  dependencies and implicit dependencies being stored in CSR form (an
+  offsets array and an index array),
+- variable keys and values are ids in a string table, so that the same
+  include directories string is only stored once.
+
+TargetView gives a read-only Target-like access to a row. The output
+functions in uninja.output accept a CompactGraph where they accept a set
+of targets.
+
+A graph can be filled while configuring: with Toolchain.graph set,
+ToolchainGCC adds the targets of each component and executable to it once
+processed, and returns views in place of them. Target objects then only
+live while their component is processed, which bounds the configure
+memory. Otherwise, CompactGraph.from_targets() builds a graph from
+processed targets, which only saves memory if the graph is kept after the
+configure step.
+"""
+
+from array           import array
+from collections.abc import Mapping
+from typing          import Iterable, Optional, Tuple, Union
+
+from .target         import Target, TargetVars
+from .rule           import Rule
+from .pool           import Pool
+
+
+class CompactGraph:
+    def __init__(self):
+        # Nodes: targets and plain files
+        self.names      = []            # Node id -> name
+        self._node_ids  = dict()        # Name -> node id
+        self.node_row   = array("i")    # Node id -> row, -1 for files (or targets not added yet)
+
+        # Interned rules, pools and strings
+        self.rules      = []
+        self._rule_ids  = dict()
+        self.pools      = [None]
+        self._pool_ids  = {None: 0}
+        self.strings    = []
+        self._str_ids   = dict()
+
+        # Rows: one per target, in insertion order
+        self.row_node   = array("i")
+        self.row_rule   = array("i")
+        self.row_pool   = array("i")
+
+        self.dep_start  = array("q", [0])
+        self.dep_nodes  = array("i")
+        self.imp_start  = array("q", [0])
+        self.imp_nodes  = array("i")
+        self.var_start  = array("q", [0])
+        self.var_keys   = array("i")
+        self.var_values = array("i")
+
+
+    ############################################
+    # Interning
+    ############################################
+
+    def node_id(self, name: str) -> int:
+        try:
+            return self._node_ids[name]
+        except KeyError:
+            nid = self._node_ids[name] = len(self.names)
+            self.names.append(name)
+            self.node_row.append(-1)
+            return nid
+
+
+    def string_id(self, value: str) -> int:
+        try:
+            return self._str_ids[value]
+        except KeyError:
+            sid = self._str_ids[value] = len(self.strings)
+            self.strings.append(value)
+            return sid
+
+
+    def _intern(self, ids, values, x) -> int:
+        try:
+            return ids[x]
+        except KeyError:
+            xid = ids[x] = len(values)
+            values.append(x)
+            return xid
+
+
+    ############################################
+    # Building
+    ############################################
+
+    def add(
+        self,
+        name: str,
+        rule: Rule,
+        deps: Iterable = tuple(),
+        vars = tuple(),
+        pool: Optional[Pool] = None,
+        implicit: Iterable = tuple()
+    ) -> int:
+        """
+        Adds a target and returns its row. deps and implicit are names, Targets or
+        TargetViews, vars a TargetVars, a mapping or (key, value) pairs. Dependencies
+        may be added later. As for TargetGraph, the first target added with a name
+        is kept.
+        """
+
+        nid = self.node_id(name)
+        if self.node_row[nid] != -1:
+            return self.node_row[nid]
+
+        row = len(self.row_node)
+        self.node_row[nid] = row
+        self.row_node.append(nid)
+        self.row_rule.append(self._intern(self._rule_ids, self.rules, rule))
+        self.row_pool.append(self._intern(self._pool_ids, self.pools, pool))
+
+        # Duplicate dependencies are only written once
+        self.dep_nodes.extend(map(self.node_id, dict.fromkeys(map(str, deps))))
+        self.dep_start.append(len(self.dep_nodes))
+        self.imp_nodes.extend(map(self.node_id, dict.fromkeys(map(str, implicit))))
+        self.imp_start.append(len(self.imp_nodes))
+
+        if hasattr(vars, "items"):
+            vars = vars.items()
+        for key, value in vars:
+            self.var_keys.append(self.string_id(key))
+            self.var_values.append(self.string_id(value))
+        self.var_start.append(len(self.var_keys))
+
+        return row
+
+
+    def add_targets(self, targets) -> Tuple:
+        """
+        Adds the given targets and the targets they depend on, dependencies
+        first, and returns views of the given targets. Views and plain files
+        are returned as is. The Target objects can then be released.
+        """
+
+        targets = tuple(targets)
+        stack   = [(tt, False) for tt in reversed(targets)]
+        while stack:
+            tt, expanded = stack.pop()
+            if not isinstance(tt, Target) or tt.name in self:
+                continue
+
+            if expanded:
+                self.add(tt.name, tt.rule, tt.deps, tt.vars, tt.pool, tt.implicit)
+            else:
+                stack.append((tt, True))
+                stack.extend((x, False) for x in reversed(tuple(tt.deps) + tuple(tt.implicit)))
+
+        return tuple(self[tt.name] if isinstance(tt, Target) else tt for tt in targets)
+
+
+    @classmethod
+    def from_targets(cls, target_set, canonical: bool = False) -> "CompactGraph":
+        """
+        Compact graph of the given targets and their dependencies, with rows
+        in the order the ninja file would have (dependencies first).
+        """
+
+        from .output import flatten
+
+        graph = cls()
+        ss, _ = flatten(target_set, canonical=canonical)
+        for tt, _ in ss.values():
+            graph.add(tt.name, tt.rule, tt.deps, tt.vars, tt.pool, tt.implicit)
+
+        return graph
+
+
+    ############################################
+    # Access
+    ############################################
+
+    def __len__(self):
+        return len(self.row_node)
+
+
+    def __iter__(self):
+        return (TargetView(self, row) for row in range(len(self.row_node)))
+
+
+    def __contains__(self, name: str):
+        nid = self._node_ids.get(str(name))
+        return nid is not None and self.node_row[nid] != -1
+
+
+    def __getitem__(self, name: str) -> "TargetView":
+        nid = self._node_ids.get(str(name))
+        if nid is None or self.node_row[nid] == -1:
+            raise KeyError(name)
+        return TargetView(self, self.node_row[nid])
+
+
+    def node(self, nid: int) -> Union["TargetView", str]:
+        row = self.node_row[nid]
+        return TargetView(self, row) if row != -1 else self.names[nid]
+
+
+    def flat(self, visited=None) -> "_Flat":
+        """
+        Same as uninja.output.flatten() for the graph: (view, dependency names) of
+        each row, skipping (and updating) the names in visited.
+        """
+
+        return _Flat(self, visited)
+
+
+class _Flat(Mapping):
+    """
+    Rows of a graph, with the same API as the dict returned by
+    uninja.output.flatten(): target name -> (view, dependency names).
+    """
+
+    def __init__(self, graph: CompactGraph, visited):
+        self.graph = graph
+        self.rows  = range(len(graph))
+
+        if visited is not None:
+            names     = graph.names
+            self.rows = [row for row in self.rows if names[graph.row_node[row]] not in visited]
+            visited.update(names[graph.row_node[row]] for row in self.rows)
+
+        self._row_set = None
+
+
+    def _entry(self, row: int):
+        graph = self.graph
+        start = graph.dep_start
+        return TargetView(graph, row), " ".join([graph.names[x] for x in graph.dep_nodes[start[row]:start[row+1]]])
+
+
+    def _has_row(self, row: int) -> bool:
+        if isinstance(self.rows, range):
+            return row in self.rows
+        if self._row_set is None:
+            self._row_set = set(self.rows)
+        return row in self._row_set
+
+
+    def __len__(self):
+        return len(self.rows)
+
+
+    def __iter__(self):
+        graph = self.graph
+        return (graph.names[graph.row_node[row]] for row in self.rows)
+
+
+    def __getitem__(self, name: str):
+        graph = self.graph
+        nid   = graph._node_ids.get(name)
+        row   = graph.node_row[nid] if nid is not None else -1
+        if row == -1 or not self._has_row(row):
+            raise KeyError(name)
+        return self._entry(row)
+
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+
+    def values(self):
+        return map(self._entry, self.rows)
+
+
+    def items(self):
+        return ((entry[0].name, entry) for entry in self.values())
+
+
+class TargetView:
+    """
+    Read-only view of a target row of a CompactGraph, with the same attributes
+    as Target. Dependencies are views for targets, and names for plain files.
+    """
+
+    __slots__ = ("graph", "row")
+
+    def __init__(self, graph: CompactGraph, row: int):
+        self.graph = graph
+        self.row   = row
+
+
+    @property
+    def name(self) -> str:
+        return self.graph.names[self.graph.row_node[self.row]]
+
+
+    @property
+    def rule(self) -> Rule:
+        return self.graph.rules[self.graph.row_rule[self.row]]
+
+
+    @property
+    def pool(self) -> Optional[Pool]:
+        return self.graph.pools[self.graph.row_pool[self.row]]
+
+
+    @property
+    def deps(self) -> Tuple:
+        g = self.graph
+        return tuple(map(g.node, g.dep_nodes[g.dep_start[self.row]:g.dep_start[self.row+1]]))
+
+
+    @property
+    def implicit(self) -> Tuple:
+        g = self.graph
+        return tuple(map(g.node, g.imp_nodes[g.imp_start[self.row]:g.imp_start[self.row+1]]))
+
+
+    @property
+    def vars(self) -> TargetVars:
+        g     = self.graph
+        start = g.var_start[self.row]
+        end   = g.var_start[self.row+1]
+        return TargetVars({
+            g.strings[k]: g.strings[v]
+            for k, v in zip(g.var_keys[start:end], g.var_values[start:end])
+        })
+
+
+    def to_target(self, memo=None) -> Target:
+        """
+        Target object of the view, with its dependencies.
+        """
+
+        memo  = dict() if memo is None else memo
+        stack = [self]
+        while stack:
+            view = stack[-1]
+            if view.row in memo:
+                stack.pop()
+                continue
+
+            children = [x for x in view.deps + view.implicit if isinstance(x, TargetView) and x.row not in memo]
+            if children:
+                stack.extend(children)
+                continue
+
+            stack.pop()
+            conv = lambda x: memo[x.row] if isinstance(x, TargetView) else x
+            memo[view.row] = Target(
+                name     = view.name,
+                rule     = view.rule,
+                deps     = tuple(map(conv, view.deps)),
+                vars     = view.vars,
+                pool     = view.pool,
+                implicit = tuple(map(conv, view.implicit))
+            )
+
+        return memo[self.row]
+
+
+    def __eq__(self, other):
+        return isinstance(other, TargetView) and other.graph is self.graph and other.row == self.row
+
+
+    def __hash__(self):
+        return hash((id(self.graph), self.row))
+
+
+    def __str__(self):
+        return self.name
+
+
+    def __repr__(self):
+        return f"TargetView({self.name!r})"
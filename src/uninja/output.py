@@ -8,68 +8,505 @@ Output tree to ninja file
 original code from September 2018
 """
 
+import hashlib
+import json
 import logging
+import re
 
-from .target import Target
-from .rule   import Phony
+from concurrent.futures import ThreadPoolExecutor
+from pathlib     import Path
+from typing      import Dict, Mapping, Optional, Set
+
+from .target     import Target
+from .graph      import CompactGraph, TargetView
+from .rule       import Phony
+from .pool       import Console
+from .utils.fs   import write_if_changed, WriteResult
 
 log = logging.getLogger("uninja.output")
 
-def add_deps( ss, ruleset, dep ):
+# Number of lines joined together before being written
+CHUNK_LINES = 65536
+
+# Length of the value hash in the names of hoisted variables
+HOIST_HASH_LEN = 12
+
+def flatten(target_set, canonical: bool = False, visited: Optional[Set[str]] = None):
     """
-    Adds dependency rule to dict ss. Value is a tuple containing
-    a list of dependency file names, and the proper target rule.
-    If dep is a string, no rule is added. is actually a postfix
-    tree walk.
+    Flattens the target graph into a dict of targets, keyed by target name.
+    Value is a tuple containing the target, and the string of its
+    dependency file names. Also returns the set of used rules.
+
+    This is an iterative postfix tree walk: each target is visited only once,
+    even if it is shared by multiple parents, so the cost is linear in the number
+    of targets and edges, and deep dependency chains do not hit the recursion limit.
+    Dependencies that are not Target objects (plain files) are kept in the
+    dependency string but not walked. Implicit dependencies are walked too,
+    but are not part of the dependency string.
+
+    In canonical mode, roots and children are walked in target name order,
+    so that the resulting order does not depend on set iteration order. The
+    dependency strings themselves keep the order given by the targets.
+
+    Targets whose name is in visited are skipped, and visited is updated
+    with the flattened targets' names.
+
+    target_set may also be a CompactGraph, whose rows are already in
+    order: canonical is then ignored.
     """
-    if isinstance( dep, Target ):
-        #if ( dep.name in ss ) and not ( dep is ss[dep.name][0] ):
-        #    print( repr(dep) )
-        #    print( repr(ss[dep.name] ) )
-        #    raise RuntimeError( "Duplicate entry : " + dep.name )
 
-        # Add rule in ruleset (only if needed)
-        ruleset.add(dep.rule)
+    if isinstance(target_set, CompactGraph):
+        return target_set.flat(visited), set(target_set.rules)
 
+    ss      = dict()
+    ruleset = set()
+    visited = set() if visited is None else visited
 
-        #########################################
-        # TODO # More explicit var names
+    # Stack items: (target, None) when the target must be expanded,
+    # (target, deps) when its children have been processed.
+    roots   = tuple(target_set)
+    if canonical:
+        roots = sorted((tt for tt in roots if isinstance(tt, Target)), key=_name_key)
+    stack   = [(tt, None) for tt in reversed(roots)]
 
-        depnames = []
-        for ch in dep.deps :
-            if not str(ch) in depnames:
-                depnames.append(str(ch))
-            add_deps( ss, ruleset, ch )
+    while stack:
+        dep, children = stack.pop()
 
-        ss[ dep.name ] = (dep, " ".join(depnames))
+        if children is not None:
+            # Deduplicate dependency names, keeping their order
+            depnames = dict.fromkeys(map(str, children))
+            ss[dep.name] = (dep, " ".join(depnames))
 
-def build_file( fhandle, target_set):
-    #if not isinstance( target_set, frozenset ):
-    #    raise TypeError("Must be frozen set of targets")
+        elif isinstance(dep, Target) and dep.name not in visited:
+            visited.add(dep.name)
+
+            # Add rule in ruleset (only if needed)
+            ruleset.add(dep.rule)
+
+            # deps may be any iterable, consume it only once
+            children = tuple(dep.deps)
+            stack.append((dep, children))
+            subs     = [ch for ch in children + tuple(dep.implicit) if isinstance(ch, Target) and ch.name not in visited]
+            if canonical:
+                subs.sort(key=_name_key)
+            stack.extend((ch, None) for ch in reversed(subs))
+
+    return ss, ruleset
+
+def _name_key(x):
+    return x.name
+
+
+def emit(target_set, canonical: bool = False, chunk_lines: int = CHUNK_LINES, hoist: bool = True):
+    """
+    Generates the content of the ninja file for the given targets, as
+    text chunks of about chunk_lines lines each.
+    """
+
+    return _chunks(emit_lines(target_set, canonical=canonical, hoist=hoist), chunk_lines)
+
+
+def _chunks(lines, chunk_lines: int = CHUNK_LINES):
+    buf = []
+    for line in lines:
+        buf.append(line)
+        if len(buf) >= chunk_lines:
+            buf.append("")
+            yield "\n".join(buf)
+            buf.clear()
+
+    if buf:
+        buf.append("")
+        yield "\n".join(buf)
+
+
+def emit_lines(target_set, canonical: bool = False, hoist: bool = True):
+    """
+    Generates the lines of the ninja file for the given targets.
+
+    In canonical mode, the output only depends on the target graph: rules are
+    sorted by name, build statements are in a stable topological order, and
+    variables are sorted by key.
+
+    With hoist, variable values repeated across targets are written once,
+    see hoist_vars().
+    """
 
     # Step 1 # Constructing set of targets
-    ss      = dict()
-    ruleset = set()
-    for tt in target_set: add_deps( ss, ruleset, tt )
+    ss, ruleset = flatten(target_set, canonical=canonical)
+
+    yield from _flat_lines(ss, ruleset, canonical, hoist)
+
+
+def _flat_lines(ss, ruleset, canonical: bool, hoist: bool = True):
+    # Step 2 # Print pools and rules
+    yield from _decl_lines(ss, ruleset, canonical)
 
-    # Step 2 # Print rules
+    # Step 3 # Printing shared variables, and targets
+    hoisted = hoist_vars(ss) if hoist else None
+    yield from _hoisted_lines(hoisted)
+    yield from _build_lines(ss, canonical, hoisted)
+
+
+def _decl_lines(ss, ruleset, canonical: bool):
+    """
+    Lines declaring the given rules, and the pools used by the rules and targets
+    """
+
+    if canonical:
+        ruleset = sorted(ruleset, key=lambda x: (x.name, x.command))
+
+    # Pools used by rules and targets
+    pools = dict()
+    for pool in (x.pool for x in ruleset if x.pool is not None):
+        _add_pool(pools, pool)
+    for pool in (rr.pool for rr, _ in ss.values() if rr.pool is not None):
+        _add_pool(pools, pool)
+
+    for pool in (sorted(pools.values(), key=_name_key) if canonical else pools.values()):
+        # The console pool is built in ninja
+        if not isinstance(pool, Console):
+            yield f"pool {pool.name}"
+            yield f"    depth = {pool.depth}"
+            yield ""
+
+    # Rules
     for rule in ruleset:
         # The phony rule is not added to the output file
         if not isinstance(rule, Phony):
-            print(f"rule {rule.name}", file=fhandle)
-            print(f"    command = {rule.command}", file=fhandle)
-            if rule.description is not None: print(f"    description = {rule.description}", file=fhandle)
-            if rule.depfile     is not None: print(f"    depfile     = {rule.depfile}"    , file=fhandle)
-            print("", file=fhandle)
+            yield f"rule {rule.name}"
+            yield f"    command = {rule.command}"
+            if rule.description is not None: yield f"    description = {rule.description}"
+            if rule.depfile     is not None: yield f"    depfile     = {rule.depfile}"
+            if rule.deps        is not None: yield f"    deps        = {rule.deps}"
+            if rule.msvc_deps_prefix is not None: yield f"    msvc_deps_prefix = {rule.msvc_deps_prefix}"
+            if rule.pool        is not None: yield f"    pool        = {rule.pool}"
+            if rule.restat:                  yield  "    restat      = 1"
+            if rule.generator:               yield  "    generator   = 1"
+            if rule.rspfile     is not None:
+                yield f"    rspfile = {rule.rspfile}"
+                yield f"    rspfile_content = {rule.rspfile_content}"
+            yield ""
+
+
+def hoist_vars(ss) -> Dict[str, str]:
+    """
+    Finds the variable values of the flattened targets that are repeated
+    enough to be written once, as a file-level variable, and referred to by
+    the build statements. Returns the name of the file-level variable of each
+    hoisted value.
+
+    ninja evaluates build variables when parsing them, so the commands are
+    the same. Names are derived from the value, so they do not depend on the
+    other targets: a change in a target does not rename the variables of
+    the others.
+    """
+
+    counts = dict() # Value -> [count, first key]
+    for rr, _ in ss.values():
+        for key, value in rr.vars.items():
+            count = counts.get(value)
+            if count is None:
+                counts[value] = [1, key]
+            else:
+                count[0] += 1
+
+    hoisted = dict()
+    taken   = set()
+    for value, (count, key) in counts.items():
+        # Declaration ("name = value") and references ("$name") must take less space
+        name_len = len(key) + 2 + HOIST_HASH_LEN
+        if count < 2 or count * len(value) <= name_len + 3 + len(value) + count * (name_len + 1):
+            continue
+
+        h    = hashlib.sha256(value.encode("utf-8")).hexdigest()
+        size = HOIST_HASH_LEN
+        name = f"_{key}_{h[:size]}"
+        while name in taken:
+            size += 4
+            name  = f"_{key}_{h[:size]}"
+
+        taken.add(name)
+        hoisted[value] = name
 
+    return hoisted
 
-    compilation_database = []
 
-    # Step 3 # Printing targets
+def _hoisted_lines(hoisted: Optional[Mapping[str, str]]):
+    if hoisted:
+        for value, name in hoisted.items():
+            yield f"{name} = {value}"
+        yield ""
+
+
+def _build_lines(ss, canonical: bool, hoisted: Optional[Mapping[str, str]] = None):
+    """
+    Lines of the build statements of the flattened targets. Variable values
+    found in hoisted refer to the file-level variable instead.
+    """
+
+    hoisted = hoisted or dict()
+
     for rr, dnames in ss.values():
-        print( "build {name} : {rule} {deps}".format( name = rr.name, rule = rr.rule, deps = dnames),file=fhandle)
-        for v in rr.vars.values:
-            print(f"    {v.key} = {v.value}", file=fhandle)
-        print("",file=fhandle)
+        if rr.implicit:
+            dnames = f"{dnames} | {' '.join(dict.fromkeys(map(str, rr.implicit)))}"
+        yield f"build {rr.name} : {rr.rule} {dnames}"
+        if rr.pool is not None:
+            yield f"    pool = {rr.pool}"
+        values = sorted(rr.vars.items()) if canonical else rr.vars.items()
+        for key, value in values:
+            name = hoisted.get(value)
+            yield f"    {key} = ${name}" if name is not None else f"    {key} = {value}"
+        yield ""
+
+
+def _add_pool(pools, pool):
+    other = pools.setdefault(pool.name, pool)
+    if other != pool:
+        raise ValueError(f"Conflicting definitions for pool {pool.name}: {other!r} and {pool!r}")
+
+
+def build_file( fhandle, target_set, canonical: bool = False, compdb: Optional[Path] = None, hoist: bool = True):
+    #if not isinstance( target_set, frozenset ):
+    #    raise TypeError("Must be frozen set of targets")
+
+    ss, ruleset = flatten(target_set, canonical=canonical)
+
+    for chunk in _chunks(_flat_lines(ss, ruleset, canonical, hoist)):
+        fhandle.write(chunk)
+
+    log.info(f"-> Output written to {getattr(fhandle, 'name', fhandle)}")
+
+    if compdb is not None:
+        _write_compdb(compdb, ss, Path(getattr(fhandle, "name", compdb)).resolve().parent)
+
+
+def write_file(path: Path, target_set, canonical: bool = False, compdb: Optional[Path] = None, hoist: bool = True) -> WriteResult:
+    """
+    Writes the ninja file for the given targets to path. The file is
+    only replaced (atomically) if its content changed, so that its mtime
+    is kept for no-op configures.
+
+    If compdb is given, the compilation database is also written there,
+    see write_compdb().
+    """
+
+    ss, ruleset = flatten(target_set, canonical=canonical)
+    result      = write_if_changed(path, _chunks(_flat_lines(ss, ruleset, canonical, hoist)))
+
+    if result.changed:
+        log.info(f"-> Output written to {result.path} ({result.bytes_written} bytes)")
+    else:
+        log.info(f"-> Output {result.path} is up to date")
+
+    if compdb is not None:
+        _write_compdb(compdb, ss, Path(path).resolve().parent)
+
+    return result
+
+
+########################################################
+# Compilation database
+########################################################
+
+# Ninja variable reference: $name, ${name}, or escaped characters
+NINJA_VAR_RE = re.compile(r"\$(?:\{([A-Za-z0-9_.-]+)\}|([A-Za-z0-9_-]+)|(.))")
+
+
+def expand(text: str, variables: Mapping[str, str]) -> str:
+    """
+    Expands ninja variables in text, as ninja does for commands. Unknown
+    variables expand to an empty string.
+    """
+
+    def repl(m):
+        name = m.group(1) or m.group(2)
+        if name is not None:
+            return variables.get(name, "")
+        return m.group(3) # $$, $:, $ (space)
+
+    return NINJA_VAR_RE.sub(repl, text)
+
+
+def compdb_entries(ss, directory: Path, rules: Optional[Set[str]] = None):
+    """
+    Generates the compilation database entries for the flattened targets,
+    with their command expanded. Only the targets of the given rule names are
+    considered, or by default of the compile rules (see Rule.compile).
+
+    A target compiling a unity file (see Rule.unity) gives an entry for each
+    source included by the file, with the same command compiling the source
+    in place of the unity file.
+    """
+
+    directory = str(directory)
+
+    for rr, dnames in ss.values():
+        rule = rr.rule
+        if isinstance(rule, Phony):
+            continue
+        if (rule.name not in rules) if rules is not None else not rule.compile:
+            continue
+
+        first = next(iter(rr.deps), None)
+        if isinstance(first, (Target, TargetView)) and first.rule.unity:
+            files = first.vars["srcs"].split()
+        else:
+            files = (dnames,)
+
+        for fname in files:
+            variables = {
+                "in":          fname,
+                "in_newline":  fname.replace(" ", "\n"),
+                "out":         rr.name,
+            }
+            variables.update(rr.vars.items())
+
+            yield {
+                "directory": directory,
+                "command":   expand(rule.command, variables),
+                "file":      fname.split(" ", 1)[0],
+                "output":    rr.name,
+            }
+
+
+def write_compdb(path: Path, target_set, directory: Optional[Path] = None, rules: Optional[Set[str]] = None) -> WriteResult:
+    """
+    Writes the compile_commands.json compilation database for the given targets,
+    as ninja -t compdb would. directory is where ninja runs, default is the
+    directory of path. The file is only replaced if its content changed.
+    """
+
+    ss, _ = flatten(target_set)
+    return _write_compdb(path, ss, directory, rules)
+
+
+def _write_compdb(path: Path, ss, directory: Optional[Path] = None, rules: Optional[Set[str]] = None) -> WriteResult:
+    path      = Path(path)
+    directory = Path(directory) if directory is not None else path.resolve().parent
+
+    def lines():
+        yield "["
+        prev = None
+        for entry in compdb_entries(ss, directory, rules):
+            if prev is not None:
+                yield f"  {prev},"
+            prev = json.dumps(entry)
+        if prev is not None:
+            yield f"  {prev}"
+        yield "]"
+
+    result = write_if_changed(path, _chunks(lines(), chunk_lines=1024))
+
+    if result.changed:
+        log.info(f"-> Compilation database written to {result.path}")
+    else:
+        log.info(f"-> Compilation database {result.path} is up to date")
+
+    return result
+
+
+def digest(target_set, canonical: bool = True) -> str:
+    """
+    Returns the SHA-256 hex digest of the ninja file content for the given
+    targets, without writing it. Two configures producing the same target
+    graph give the same digest in canonical mode.
+    """
+
+    h = hashlib.sha256()
+    for chunk in emit(target_set, canonical=canonical):
+        h.update(chunk.encode("utf-8"))
+
+    return h.hexdigest()
+
+
+def write_sharded(
+    path: Path,
+    shards: Mapping[str, any],
+    canonical: bool = True,
+    workers: Optional[int] = None,
+    hoist: bool = True
+) -> Dict[Path, WriteResult]:
+    """
+    Writes the targets as a set of ninja files, rather than a single one:
+
+    - <stem>-rules.ninja, next to path, declares the pools and rules of all shards,
+    - <stem>-shards/<shard>.ninja holds the build statements of each shard,
+    - path includes the rules file and each shard file (using subninja).
+
+    shards maps a shard name to its targets, for instance the result of
+    Toolchain.process for each component and executable. A target reachable
+    from several shards is written in the first one only, so dependencies
+    should come first (see uninja.codebase.c.components_closure): a change in
+    one component then only changes its own shard file.
+
+    Files are written in parallel, each only if its content changed, and
+    stale shard files are removed. Paths in path are relative to its
+    directory, where ninja must run. Returns the WriteResult of each file,
+    by path.
+    """
+
+    path       = Path(path)
+    rules_path = path.parent / f"{path.stem}-rules.ninja"
+    shards_dir = path.parent / f"{path.stem}-shards"
+    shards_dir.mkdir(parents=True, exist_ok=True)
+
+    # Flatten each shard, skipping targets of previous shards
+    visited = set()
+    flat    = dict()
+    ss_all  = dict()
+    rules   = set()
+    fnames  = set()
+    for name, targets in shards.items():
+        ss, ruleset = flatten(targets, canonical=canonical, visited=visited)
+
+        fname = _shard_filename(name, fnames)
+        fnames.add(fname)
+
+        flat[name] = (shards_dir / fname, ss)
+        ss_all.update(ss)
+        rules.update(ruleset)
+
+    # Top-level file
+    top_lines = [f"include {rules_path.relative_to(path.parent)}", ""]
+    top_lines.extend(f"subninja {shard_path.relative_to(path.parent)}" for shard_path, _ in flat.values())
+
+    files = [
+        (path,       top_lines),
+        (rules_path, _decl_lines(ss_all, rules, canonical)),
+        *((shard_path, _shard_lines(ss, canonical, hoist)) for shard_path, ss in flat.values())
+    ]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = dict(pool.map(lambda x: (x[0], write_if_changed(x[0], _chunks(x[1]))), files))
+
+    # Remove shards that do not exist anymore
+    for stale in shards_dir.glob("*.ninja"):
+        if stale.name not in fnames:
+            stale.unlink()
+
+    changed = [fpath for fpath, r in results.items() if r.changed]
+    log.info(f"-> Sharded output written to {path} ({len(shards)} shards, {len(changed)} files changed)")
+    for fname in changed:
+        log.debug(f" -- Changed: {fname}")
+
+    return results
+
+
+def _shard_lines(ss, canonical: bool, hoist: bool):
+    # Variables are hoisted per shard: the scope of a subninja file is its own
+    hoisted = hoist_vars(ss) if hoist else None
+    yield from _hoisted_lines(hoisted)
+    yield from _build_lines(ss, canonical, hoisted)
+
+
+def _shard_filename(name: str, taken: Set[str]) -> str:
+    base  = re.sub(r"[^A-Za-z0-9._-]", "_", str(name)).strip(".") or "shard"
+    fname = f"{base}.ninja"
+
+    i = 1
+    while fname in taken:
+        fname = f"{base}-{i}.ninja"
+        i    += 1
 
-    log.info(f"-> Output written to {getattr(fhandle, 'name')}")
\ No newline at end of file
+    return fname
@@ -0,0 +1,38 @@
+"""
+================
+Pool declaration
+================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+"""
+
+from dataclasses import dataclass
+
+
+@dataclass(eq=True, frozen=True)
+class Pool:
+    """
+    Limits the number of concurrent jobs of the rules and targets
+    assigned to it to depth.
+    """
+
+    name: str
+    depth: int
+
+    def __post_init__(self):
+        if self.depth < 1:
+            raise ValueError(f"Pool {self.name} depth must be at least 1, got {self.depth}")
+
+    def __str__(self):
+        return self.name
+
+@dataclass(eq=True, frozen=True)
+class Console(Pool):
+    """
+    Built-in ninja pool: jobs have direct access to the console, and
+    run one at a time. It is not declared in the output file.
+    """
+
+    name:  str = "console"
+    depth: int = 1
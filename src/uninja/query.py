@@ -0,0 +1,394 @@
+"""
+===========================================
+Change impact queries over the target graph
+===========================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Builds a reverse dependency index of the build graph, either from the targets
+in memory or from a generated ninja file, with the header dependencies recorded
+in depfiles or in the ninja deps log (.ninja_deps). Given a list of changed
+files, the index returns the targets that must be built again: objects,
+archives, executables, clang-tidy logs, etc.
+
+Queries only walk the affected part of the graph, so their cost is linear in
+the size of the answer (and of the edges leading to it).
+
+From the command line, in CI for instance:
+
+    python -m uninja.query build/build.ninja src/foo/foo.h src/bar/bar.c
+"""
+
+import logging
+import os
+import re
+import struct
+import sys
+
+from collections import deque
+from pathlib     import Path
+from typing      import Dict, Iterable, List, Optional, Tuple
+
+from .rule       import Phony
+from .output     import flatten, expand
+
+log = logging.getLogger("uninja.query")
+
+# Tokens of a build line: paths (with escapes), and the :, |, || and |@ separators
+BUILD_TOKEN_RE = re.compile(r"(?:\$.|[^\s$:|])+|\|\||\|@|\||:")
+
+# Separators of depfile paths: non escaped whitespace
+DEPFILE_SPLIT_RE = re.compile(r"(?<!\\)\s+")
+
+# ninja deps log
+DEPS_LOG_MAGIC = b"# ninjadeps\n"
+
+
+class ImpactIndex:
+    """
+    Reverse dependency index of a build graph. Paths are relative to build_dir
+    (where ninja runs) or absolute, they are normalized when added.
+    """
+
+    def __init__(self, build_dir: Path):
+        self.build_dir = Path(build_dir).resolve()
+
+        self._edges    = []      # [(outputs, rule name)]
+        self._rdeps    = dict()  # Input -> [edge index]
+        self._producer = dict()  # Output -> edge index
+        self._names    = dict()  # Output -> name as written in the build graph
+        self._depfiles = dict()  # Edge index -> depfile path
+
+
+    def _norm(self, path) -> str:
+        return os.path.normpath(os.path.join(self.build_dir, path))
+
+
+    def add_edge(self, outputs: Iterable[str], rule: str, inputs: Iterable[str], depfile: Optional[str] = None) -> int:
+        """
+        Adds a build edge, and returns its index.
+        """
+
+        index   = len(self._edges)
+        outputs = tuple(outputs)
+        self._edges.append((outputs, rule))
+
+        for out in outputs:
+            norm = self._norm(out)
+            self._producer[norm] = index
+            self._names[norm]    = out
+
+        for dep in inputs:
+            self._rdeps.setdefault(self._norm(dep), []).append(index)
+
+        if depfile:
+            self._depfiles[index] = depfile
+
+        return index
+
+
+    def add_deps(self, output: str, inputs: Iterable[str]):
+        """
+        Adds dependencies discovered for an output, from a depfile or the deps log.
+        """
+
+        index = self._producer.get(self._norm(output))
+        if index is None:
+            return
+
+        for dep in inputs:
+            rdeps = self._rdeps.setdefault(self._norm(dep), [])
+            if index not in rdeps[-1:]:
+                rdeps.append(index)
+
+
+    ############################################
+    # Sources
+    ############################################
+
+    @classmethod
+    def from_targets(cls, target_set, build_dir: Path) -> "ImpactIndex":
+        """
+        Index of the given targets, as they would be written in a ninja file
+        running in build_dir.
+        """
+
+        index = cls(build_dir)
+        ss, _ = flatten(target_set)
+
+        for tt, dnames in ss.values():
+            inputs = dnames.split() + [str(x) for x in tt.implicit]
+
+            depfile = None
+            if not isinstance(tt.rule, Phony) and tt.rule.depfile is not None:
+                variables = dict(tt.vars.items())
+                variables.update({"out": tt.name, "in": dnames})
+                depfile   = expand(tt.rule.depfile, variables)
+
+            index.add_edge((tt.name,), str(tt.rule), inputs, depfile)
+
+        return index
+
+
+    @classmethod
+    def from_ninja(cls, path: Path, build_dir: Optional[Path] = None) -> "ImpactIndex":
+        """
+        Index of a generated ninja file, with its include and subninja files.
+        build_dir is the directory where ninja runs, default is the directory of path.
+        """
+
+        path  = Path(path)
+        index = cls(build_dir if build_dir is not None else path.resolve().parent)
+        index._parse(path.resolve(), dict(), dict())
+
+        return index
+
+
+    def _parse(self, path: Path, variables: Dict[str, str], rules: Dict[str, Dict[str, str]]):
+        with open(self.build_dir / path, "r") as fhandle:
+            text = fhandle.read()
+
+        # Join continuation lines, ending with an odd number of $
+        text  = re.sub(r"(?<!\$)((?:\$\$)*)\$\n[ \t]*", r"\1", text)
+
+        block = None # Variables of the current rule or build block
+        edge  = None
+
+        def close_edge():
+            if edge is not None:
+                outputs, rule, inputs, build_vars = edge
+                scope   = {**variables, **rules.get(rule, {}), **build_vars, "out": " ".join(outputs), "in": " ".join(inputs)}
+                depfile = build_vars.get("depfile", rules.get(rule, {}).get("depfile"))
+                self.add_edge(outputs, rule, inputs, expand(depfile, scope) if depfile else None)
+
+        for line in text.split("\n"):
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+
+            # Block variables, evaluated when parsed for build statements
+            if line[0] in " \t":
+                if block is not None:
+                    key, _, value = stripped.partition("=")
+                    block[key.strip()] = expand(value.strip(), variables) if edge is not None else value.strip()
+                continue
+
+            close_edge()
+            block = None
+            edge  = None
+
+            keyword, _, rest = stripped.partition(" ")
+
+            if keyword == "rule":
+                block = rules[rest.strip()] = dict()
+
+            elif keyword == "build":
+                edge  = self._parse_build(rest, variables)
+                block = edge[3]
+
+            elif keyword in ("include", "subninja"):
+                self._parse(Path(expand(rest.strip(), variables)), variables, rules)
+
+            elif keyword in ("pool", "default"):
+                block = dict() if keyword == "pool" else None
+
+            else:
+                key, _, value   = stripped.partition("=")
+                variables[key.strip()] = expand(value.strip(), variables)
+
+        close_edge()
+
+
+    @staticmethod
+    def _parse_build(text: str, variables: Dict[str, str]):
+        outputs = []
+        inputs  = []
+        rule    = None
+        part    = "out"
+
+        for token in BUILD_TOKEN_RE.findall(text):
+            if token == ":":
+                part = "rule"
+            elif token == "|":
+                part = "implicit_out" if part == "out" else "in"
+            elif token in ("||", "|@"):
+                part = "order_only"
+            elif part == "rule":
+                rule = token
+                part = "in"
+            elif part in ("out", "implicit_out"):
+                outputs.append(expand(token, variables))
+            elif part == "in":
+                inputs.append(expand(token, variables))
+
+        # Order-only and validation dependencies do not trigger a rebuild
+        return (tuple(outputs), rule, inputs, dict())
+
+
+    ############################################
+    # Header dependencies
+    ############################################
+
+    def load_depfiles(self) -> int:
+        """
+        Merges the dependencies of the depfiles that exist, returns their number.
+        With a deps mode, ninja removes depfiles after reading them, see load_deps_log().
+        """
+
+        count = 0
+        for index, depfile in self._depfiles.items():
+            try:
+                with open(self.build_dir / depfile, "r") as fhandle:
+                    text = fhandle.read()
+            except OSError:
+                continue
+
+            count += 1
+            for output in self._edges[index][0]:
+                self.add_deps(output, parse_depfile(text))
+
+        return count
+
+
+    def load_deps_log(self, path: Optional[Path] = None) -> int:
+        """
+        Merges the dependencies recorded in the ninja deps log, default is
+        .ninja_deps in build_dir. Returns the number of outputs with dependencies.
+        """
+
+        deps = read_deps_log(path if path is not None else self.build_dir / ".ninja_deps")
+        for output, inputs in deps.items():
+            self.add_deps(output, inputs)
+
+        return len(deps)
+
+
+    ############################################
+    # Queries
+    ############################################
+
+    def affected(self, changed: Iterable[str], base: Optional[Path] = None) -> Tuple[str]:
+        """
+        Returns the outputs that depend, directly or not, on the changed files.
+        Paths of the changed files are relative to base, default is the current
+        directory. Outputs are given as written in the build graph, in the order
+        they are reached.
+        """
+
+        base   = Path(base).resolve() if base is not None else Path.cwd()
+        queue  = deque(os.path.normpath(os.path.join(base, x)) for x in changed)
+        seen   = set()
+        result = []
+
+        while queue:
+            node = queue.popleft()
+            for index in self._rdeps.get(node, ()):
+                if index in seen:
+                    continue
+                seen.add(index)
+
+                for out in self._edges[index][0]:
+                    result.append(out)
+                    queue.append(self._norm(out))
+
+        return tuple(result)
+
+
+    def by_rule(self, outputs: Iterable[str]) -> Dict[str, Tuple[str]]:
+        """
+        Groups outputs by the name of the rule building them.
+        """
+
+        groups = dict()
+        for out in outputs:
+            index = self._producer.get(self._norm(out))
+            rule  = self._edges[index][1] if index is not None else None
+            groups.setdefault(rule, []).append(out)
+
+        return {k: tuple(v) for k, v in groups.items()}
+
+
+########################################################
+# Dependency files
+########################################################
+
+def parse_depfile(text: str) -> List[str]:
+    """
+    Returns the dependencies listed in a Makefile style depfile, as written by gcc -MD.
+    """
+
+    text = text.replace("\\\r\n", " ").replace("\\\n", " ")
+    deps = []
+
+    for line in text.splitlines():
+        # Rule target ends at the first ": " (paths may contain drive letters)
+        m = re.search(r":(\s|$)", line)
+        if m is None:
+            continue
+
+        for token in DEPFILE_SPLIT_RE.split(line[m.end():].strip()):
+            if token:
+                deps.append(token.replace("\\ ", " ").replace("\\#", "#").replace("$$", "$"))
+
+    return deps
+
+
+def read_deps_log(path: Path) -> Dict[str, Tuple[str]]:
+    """
+    Reads a ninja deps log (versions 3 and 4), returns the dependencies of each
+    output. Later records override earlier ones, as in ninja.
+    """
+
+    try:
+        with open(path, "rb") as fhandle:
+            data = fhandle.read()
+    except FileNotFoundError:
+        return dict()
+
+    if not data.startswith(DEPS_LOG_MAGIC):
+        raise ValueError(f"{path} is not a ninja deps log")
+
+    pos        = len(DEPS_LOG_MAGIC)
+    version,   = struct.unpack_from("<i", data, pos)
+    pos       += 4
+    if version not in (3, 4):
+        raise ValueError(f"Unsupported ninja deps log version {version} in {path}")
+
+    mtime_size = 8 if version == 4 else 4
+    paths      = []
+    deps       = dict()
+
+    while pos + 4 <= len(data):
+        size,  = struct.unpack_from("<I", data, pos)
+        pos   += 4
+        is_dep = size >> 31
+        size  &= 0x7fffffff
+
+        record = data[pos:pos+size]
+        pos   += size
+        if len(record) < size:
+            break # Truncated by an interrupted build
+
+        if is_dep:
+            out_id = struct.unpack_from("<i", record, 0)[0]
+            ids    = struct.unpack_from(f"<{(size - 4 - mtime_size) // 4}i", record, 4 + mtime_size)
+            deps[paths[out_id]] = tuple(paths[x] for x in ids)
+        else:
+            paths.append(record[:-4].rstrip(b"\0").decode("utf-8", errors="surrogateescape"))
+
+    return deps
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__, file=sys.stderr)
+        sys.exit(2)
+
+    index = ImpactIndex.from_ninja(Path(sys.argv[1]))
+    index.load_deps_log()
+    index.load_depfiles()
+
+    for rule, outputs in sorted(index.by_rule(index.affected(sys.argv[2:])).items(), key=lambda x: str(x[0])):
+        for out in outputs:
+            print(f"{rule}\t{out}")
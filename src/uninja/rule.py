@@ -10,6 +10,8 @@ Rule declaration
 from dataclasses import dataclass, field
 from typing      import Optional
 
+from .pool       import Pool
+
 
 @dataclass(eq=True, frozen=True)
 class Rule:
@@ -18,16 +20,58 @@ class Rule:
     description: Optional[str] = None
     depfile: Optional[str]     = None
 
-    # deps argument not supported yet
-    # msvc_deps_prefix not supported yet
+    # Special dependency processing: "gcc" or "msvc". ninja then stores
+    # header dependencies in its .ninja_deps log instead of reading depfiles.
+    deps: Optional[str]             = None
+    msvc_deps_prefix: Optional[str] = None
+
+    # Response file: ninja writes rspfile_content (usually $in) to rspfile
+    # before running the command, which avoids very long command lines.
+    rspfile: Optional[str]          = None
+    rspfile_content: Optional[str]  = None
+
+    # Pool limiting the number of concurrent jobs for this rule
+    pool: Optional[Pool]            = None
+
+    # If set, ninja checks again the outputs mtime after running the command,
+    # and skips dependent targets whose inputs did not actually change.
+    restat: bool                    = False
+
+    # Marks a rule that regenerates the ninja file itself: its outputs are
+    # not cleaned, and changing its command does not rebuild them.
+    generator: bool                 = False
+
+    # Marks a rule compiling its first input to an object file: its targets
+    # are the entries of the compilation database (see uninja.output.write_compdb).
+    compile: bool                   = False
+
+    # Marks a rule generating a unity file, which includes the sources listed
+    # in its srcs variable. The compilation database lists each of these
+    # sources in place of the unity file.
+    unity: bool                     = False
+
     # dyndep not supported yet
-    # generator not supported yet
-    # restat not supported yet
-    # rspfile and rspfile_content not supported yet
+
+    def __post_init__(self):
+        if self.deps not in (None, "gcc", "msvc"):
+            raise ValueError(f"Unsupported deps mode for rule {self.name}: {self.deps}")
+
+        if (self.rspfile is None) != (self.rspfile_content is None):
+            raise ValueError(f"rspfile and rspfile_content must be given together for rule {self.name}")
 
     def __str__(self):
         return self.name
 
+def replace_if_changed(tmp: str = "$out.tmp", out: str = "$out") -> str:
+    """
+    Shell command moving tmp to out only if their content differ. To be
+    used at the end of a restat rule command that writes to tmp, so that
+    the mtime of out only changes with its content.
+    """
+
+    return f"(cmp -s {tmp} {out} && rm -f {tmp} || mv -f {tmp} {out})"
+
+
 @dataclass(eq=True, frozen=True)
 class Phony(Rule):
     name:        str = "phony"
@@ -11,9 +11,11 @@ original source code from  September 2018
 
 from dataclasses import dataclass, field
 import re
-from typing import Set, Optional, Dict, Callable, FrozenSet, Tuple
+from typing import Set, Optional, Dict, Callable, FrozenSet, Mapping, Tuple
 
-from .rule import Rule
+from .rule          import Rule
+from .pool          import Pool
+from .utils.hashing import cached_hash
 
 import logging
 
@@ -24,42 +26,135 @@ class TargetVar:
     key: str
     value: str
 
+# Overlays deeper than this are merged in a single dict, which bounds the
+# cost of lookups
+VARS_MAX_DEPTH = 8
+
+_MISSING = object()
+
+@cached_hash
 @dataclass(eq=True, frozen=True)
 class TargetVars:
-    values: FrozenSet[TargetVar] = field(default_factory=frozenset)
+    """
+    Immutable ordered mapping of the ninja variables of a target. with_var()
+    and appending() return an overlay holding the changed variable over this
+    TargetVars, which is shared rather than copied. Equality and hash only
+    depend on the resulting variables, not on their order.
+    """
+
+    # Variables set at this level, over the ones of base. Must not be
+    # modified. An iterable of TargetVar is also accepted.
+    mapping: Mapping[str, str]   = field(default_factory=dict)
+    base: Optional["TargetVars"] = None
+
+    def __post_init__(self):
+        if not isinstance(self.mapping, dict):
+            mapping = self.mapping.items() if hasattr(self.mapping, "items") else ((x.key, x.value) for x in self.mapping)
+            object.__setattr__(self, "mapping", dict(mapping))
+
+        object.__setattr__(self, "_depth", 0 if self.base is None else self.base._depth + 1)
+
+
+    def __eq__(self, other):
+        if not isinstance(other, TargetVars):
+            return NotImplemented
+        return self is other or self._merged() == other._merged()
+
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
 
     @classmethod
     def from_args(cls, **kwargs):
-        return cls(frozenset({
-            TargetVar(k,v) for k,v in kwargs.items()
-        }))
+        return cls(kwargs)
+
+
+    def _merged(self) -> Dict[str, str]:
+        """
+        All the variables, in a dict that must not be modified.
+        """
+
+        if self.base is None:
+            return self.mapping
+
+        chain = []
+        tv    = self
+        while tv is not None:
+            chain.append(tv.mapping)
+            tv = tv.base
+
+        # update() keeps the position of existing keys
+        merged = dict()
+        for mapping in reversed(chain):
+            merged.update(mapping)
+        return merged
+
+
+    def items(self):
+        return self._merged().items()
+
+
+    def keys(self):
+        return self._merged().keys()
+
+
+    def values(self):
+        return self._merged().values()
+
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        tv = self
+        while tv is not None:
+            value = tv.mapping.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            tv = tv.base
+        return default
+
+
+    def __getitem__(self, key: str) -> str:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
 
 
-    def get(self, key: str):
-        try:
-            return next(filter(lambda x: x.key == key, self._values))
-        except StopIteration:
-            return None
+    def __contains__(self, key: str):
+        return self.get(key, _MISSING) is not _MISSING
 
 
-    def assign(self, key: str, value: str):
-        old_var = self.get(key)
+    def __iter__(self):
+        return iter(self._merged())
 
-        # This is kinda dirty...
-        self.values = (self.values.difference(old_var) if old_var is not None else self.values).union(TargetVar(key,value))
 
+    def __len__(self):
+        return len(self._merged())
 
-    def append(self, key: str, value: str):
-        var = self.get(key)
-        
-        if var is not None:
-            var.value += " " + value
-        else:
-            var = TargetVar(key, value)
 
-        self.assign(key, var.value)
+    def with_var(self, key: str, value: str) -> "TargetVars":
+        """
+        Returns a TargetVars with key set to value. An existing key keeps its position.
+        """
 
+        if self._depth + 1 >= VARS_MAX_DEPTH:
+            mapping      = dict(self._merged())
+            mapping[key] = value
+            return TargetVars(mapping)
 
+        return TargetVars({key: value}, self)
+
+
+    def appending(self, key: str, value: str, sep: str = " ") -> "TargetVars":
+        """
+        Returns a TargetVars with value appended to the value of key, or set if missing.
+        """
+
+        old = self.get(key)
+        return self.with_var(key, value if old is None else f"{old}{sep}{value}")
+
+
+@cached_hash
 @dataclass(eq=True, frozen=True)
 class Target:
     name: str
@@ -75,9 +170,62 @@ class Target:
     # but this is somehow complex for nothing.
     vars: TargetVars = field(default_factory=TargetVars)
 
+    # Pool for this target only, overrides the pool of the rule
+    pool: Optional[Pool] = None
+
+    # Implicit dependencies (ninja "| deps"): the target is rebuilt when they
+    # change, but they are not part of $in.
+    implicit: Tuple["Target"] = field(default = tuple())
+
 
     def __str__(self):
         return self.name
 
     def is_phony(self):
-        return isinstance(self.rule, Phony)
\ No newline at end of file
+        return isinstance(self.rule, Phony)
+
+class TargetGraph:
+    """
+    Mutable collector of targets, for processors to gather their results
+    in amortized O(1) per target instead of concatenating tuples. Targets
+    are kept in insertion order, and an entry with an already collected
+    name is ignored, so that no duplicate dependency is generated.
+
+    Use freeze() to get the final tuple of targets, for instance as the
+    deps of a parent Target. A TargetGraph can also directly be given to
+    uninja.output.
+    """
+
+    def __init__(self, targets = tuple()):
+        self._targets = dict()
+        self.extend(targets)
+
+
+    def add(self, target):
+        self._targets.setdefault(str(target), target)
+
+
+    def extend(self, targets):
+        for tt in targets:
+            self._targets.setdefault(str(tt), tt)
+
+
+    def __iadd__(self, targets):
+        self.extend(targets)
+        return self
+
+
+    def __iter__(self):
+        return iter(self._targets.values())
+
+
+    def __len__(self):
+        return len(self._targets)
+
+
+    def __contains__(self, target):
+        return str(target) in self._targets
+
+
+    def freeze(self) -> Tuple[Target]:
+        return tuple(self._targets.values())
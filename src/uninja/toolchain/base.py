@@ -9,13 +9,16 @@ Base classes to define a toolchain
 
 
 import logging
+import multiprocessing
+import os
 
 from pathlib     import Path
 
 from dataclasses import dataclass, field
-from typing      import Dict, Tuple, Type, Callable, FrozenSet
+from typing      import Dict, Tuple, Type, Callable, FrozenSet, Optional
 
-from ..          import Target, Rule
+from ..          import Target, TargetGraph, Rule
+from .           import parallel
 
 
 @dataclass
@@ -34,21 +37,174 @@ class Toolchain:
     # User settings that can be used by processor functions
     settings: Dict[str, any] = field(default_factory=dict)
 
+    # Keep the targets generated for each node, so that a node shared
+    # by multiple parents is processed only once.
+    memoize: bool = True
+
+    # Optional on-disk cache of the targets generated for each node, kept
+    # between configures (see uninja.toolchain.cache.ConfigureCache).
+    configure_cache: Optional["ConfigureCache"] = None
+
+    # Optional compact store of the targets (see uninja.graph.CompactGraph).
+    # Toolchains supporting it (ToolchainGCC) add the targets of each node to
+    # it, and return views in place of Target objects: output the graph
+    # rather than the returned targets. Nodes are then processed sequentially.
+    graph: Optional["CompactGraph"] = None
+
     
     def __post_init__(self):
         self.log = logging.getLogger(f"toolchain")
 
+        if self.graph is not None and self.configure_cache is not None:
+            raise ValueError("A toolchain cannot use both a graph and a configure cache")
+
+        self._cache       = dict()
+        self.cache_hits   = 0
+        self.cache_misses = 0
+
+        self._fingerprint = None
+
+        self._resolved    = dict()
+        self._relative    = dict()
+        self.path_hits    = 0
+        self.path_lookups = 0 # Number of actual Path.resolve() calls
+
 
     def process(self, x: any) -> Tuple[Target]:
+        if self.memoize:
+            targets = self._cache.get(x, None)
+            if targets is not None:
+                self.cache_hits += 1
+                if self.configure_cache is not None:
+                    self.configure_cache.link(self.configure_cache.key(self, x))
+                return targets
+
         processor = self.processors.get(type(x), None)
 
         if processor is None:
             raise KeyError(f"No processor has been registered for item type: {type(x)}")
 
-        return processor(self, x)
+        if self.configure_cache is not None:
+            targets = self.configure_cache.process(self, x, processor)
+        else:
+            targets = tuple(processor(self, x))
+
+        if self.memoize:
+            self.cache_misses += 1
+            self._cache[x]     = targets
+
+        return targets
+
+
+    def process_many(self, nodes, workers: Optional[int] = None) -> Tuple[Target]:
+        """
+        Processes the given nodes across a pool of worker processes, and returns
+        the merged targets, the same as processing each node in turn.
+
+        Independent nodes are processed in parallel, and a node containing other
+        given nodes is processed after them, reusing their targets. So giving
+        every component and executable of the workspace (see
+        uninja.codebase.c.components_closure) gives the most parallelism.
+
+        Uses forked processes; nodes are processed sequentially if workers is 1
+        or if fork is not available. Default workers is the number of CPUs.
+        """
+
+        nodes = tuple(nodes)
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        # Graph rows are added in the process owning the graph
+        if self.graph is not None:
+            workers = 1
+
+        if workers > 1 and len(nodes) > 1 and "fork" in multiprocessing.get_all_start_methods():
+            results = parallel.process_many(self, nodes, workers)
+        else:
+            results = {x: self.process(x) for x in nodes}
+
+        targets = TargetGraph()
+        for x in nodes:
+            targets += results[x]
+
+        return targets.freeze()
+
+
+    def cache_invalidate(self, x: any = None):
+        """
+        Removes the cached targets for node x, or the whole cache if x is None.
+        """
+
+        if x is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(x, None)
+
+
+    def fingerprint(self, fp) -> bytes:
+        """
+        Digest of everything that changes the generated targets, apart from the
+        processed nodes: directories, settings and processors. fp is the
+        Fingerprinter of the configure cache.
+        """
+
+        if self._fingerprint is None:
+            self._fingerprint = fp((
+                self.root_dir,
+                Path.cwd(), # Relative node paths are resolved from there
+                tuple(self.settings.items()),
+                tuple(self.processors.items())
+            ))
+
+        return self._fingerprint
+
+
+    ############################################
+    # Path resolution cache
+    ############################################
+
+    def resolve(self, path: Path) -> Path:
+        """
+        Cached Path.resolve(): the filesystem is only walked once per path.
+        """
+
+        try:
+            resolved = self._resolved[path]
+            self.path_hits += 1
+        except KeyError:
+            self.path_lookups += 1
+            resolved = self._resolved[path] = Path(path).resolve()
+
+        return resolved
+
+
+    def relative(self, path: Path) -> Path:
+        """
+        Cached resolved path of path, relative to root_dir.
+        """
+
+        try:
+            rel = self._relative[path]
+            self.path_hits += 1
+        except KeyError:
+            rel = self._relative[path] = self.resolve(path).relative_to(self.root_dir)
+
+        return rel
+
+
+    def paths_invalidate(self):
+        """
+        Clears the path resolution cache, if the filesystem changed.
+        """
+
+        self._resolved.clear()
+        self._relative.clear()
 
 
     def processor_register(self, x: Type, processor: Callable[["Toolchain", any], Tuple[Target]]):
         if x in self.processors:
             raise KeyError(f"Processor already register for type {x}")
-        self.processors[x] = processor
\ No newline at end of file
+        self.processors[x] = processor
+        self.cache_invalidate()
+        self._fingerprint = None
\ No newline at end of file
@@ -6,6 +6,10 @@ clang-tidy toolchain definition for some source-checks!
 :Date: July 2023
 """
 
+import json
+import shlex
+import sys
+
 from dataclasses           import dataclass
 from pathlib               import Path
 
@@ -14,29 +18,81 @@ from typing                import Optional, Tuple, FrozenSet
 from uninja.codebase.c     import Source, SourceLang, Component, Executable, StaticLib, Define
 from uninja.toolchain.base import Toolchain
 
-from uninja                import Target, TargetVars, Rule
+from uninja                import Target, TargetVars, TargetGraph, Rule, Pool
+from uninja.rule           import replace_if_changed
 
 @dataclass
 class ToolchainClangTidy:
     checks: Tuple[str] = ("*", "-llvm*",) # List of checks that are enabled or disabled, tuple as order must be kept
     errors: Tuple[str] = ("*",)           # List of checks that are considered as errors, tuple as order must be kept
 
+    # Pool for clang-tidy jobs, for instance Pool("tidy", os.cpu_count() // 2)
+    pool: Optional[Pool] = None
+
+    # Batched mode: None checks each source with its own clang-tidy process,
+    # 0 uses one process per component (or executable), N > 0 one process per
+    # group of at most N sources. See batch.py.
+    batch_size: Optional[int] = None
+
+    # Launcher prepended to clang-tidy commands, for instance a clang-tidy cache
+    launcher: Tuple[str] = tuple()
+
     def __post_init__(self):
+        if self.batch_size is not None and self.batch_size < 0:
+            raise ValueError(f"Invalid clang-tidy batch size: {self.batch_size}")
+
         # Checks string
         checks = ",".join(self.checks)
         errors = ",".join(self.errors)
+        tidy   = "".join(f"{x} " for x in self.launcher) + "clang-tidy"
 
         # Init rules
         self.rule_ctidy = Rule(
             name        = "ctidy",
             description = "Checking $in...",
-            command     = f"clang-tidy --quiet --header-filter=. --checks={checks} --warnings-as-errors={errors} $in -- $incdirs $defines > $out || true" 
+            command     = f"{tidy} --quiet --header-filter=. --checks={checks} --warnings-as-errors={errors} $in -- $incdirs $defines > $out || true",
+            pool        = self.pool
+        )
+
+        # One clang-tidy process for several sources, the batch driver
+        # writes the log of each source and only checks the outdated ones.
+        driver = Path(__file__).with_name("batch.py")
+        self.rule_ctidy_batch = Rule(
+            name            = "ctidy_batch",
+            description     = "Checking $out...",
+            command         = f"{shlex.quote(sys.executable)} {shlex.quote(str(driver))} $out $out.rsp -- {tidy} --quiet --header-filter=. --checks={checks} --warnings-as-errors={errors}",
+            rspfile         = "$out.rsp",
+            rspfile_content = "$entries",
+            pool            = self.pool,
+            restat          = True
         )
 
+        # The lock file gathers the check logs, and is only replaced if they
+        # changed, so that dependent locks are not rebuilt for nothing.
         self.rule_touch_after = Rule(
             name        = "touch_after",
-            description = "Touchgin $out...",
-            command     = "touch $out"
+            description = "Gathering $out...",
+            command     = f"cat /dev/null $in > $out.tmp && {replace_if_changed()}",
+            restat      = True
+        )
+
+
+    def source_log(self, tools: Toolchain, src: Source) -> str:
+        return f"ctidy/{tools.relative(src.path)}.log"
+
+
+    def source_incdirs(self, tools: Toolchain, src: Source) -> Tuple[str]:
+        return (
+            "-iquote", str(tools.resolve(src.path.parent)),
+            *(x for path in sorted(src.incdirs_local,  key=str) for x in ("-iquote", str(path))),
+            *(x for path in sorted(src.incdirs_system, key=str) for x in ("-I",      str(path))),
+        )
+
+
+    def source_defines(self, tools: Toolchain, src: Source) -> Tuple[str]:
+        return tuple(
+            f"-D{x.name}" + (f"={x.value}" if x.value is not None else "")
+            for x in sorted(src.defines, key=lambda x: x.name)
         )
 
 
@@ -44,83 +100,127 @@ class ToolchainClangTidy:
         tools.log.info(f"Add check for C source: {src.path}")
 
         target = Target(
-            name = f"ctidy/{src.path.resolve().relative_to(tools.root_dir)}.log",
+            name = self.source_log(tools, src),
             rule = self.rule_ctidy,
-            deps = (src.path.resolve(),),
+            deps = (tools.resolve(src.path),),
 
             # FIXME # No escaping for defines, can cause some bugs?
             vars = TargetVars.from_args(
-                incdirs = f"-iquote {src.path.parent.resolve()}" \
-                    + "".join(map(lambda x: f" -iquote {x!s}", src.incdirs_local)) \
-                    + "".join(map(lambda x: f" -I {x!s}", src.incdirs_system)),
-
-                defines = " ".join(map(lambda x: f"-D{x.name}" + (f"={x.value}" if x.value is not None else ""), src.defines))
+                incdirs = " ".join(self.source_incdirs(tools, src)),
+                defines = " ".join(self.source_defines(tools, src))
             )
         )
 
         return (target,)
 
 
+    def process_batches(self, tools: Toolchain, name: str, srcs):
+        """
+        Returns the ctidy_batch targets checking the given sources, as
+        ctidy-batch/{name}.{index}.log. Sources are grouped by batch_size, in
+        the order given.
+        """
+
+        srcs = tuple(srcs)
+        size = self.batch_size or max(len(srcs), 1)
+
+        targets = []
+        for index, start in enumerate(range(0, len(srcs), size)):
+            batch   = srcs[start:start+size]
+            entries = [
+                {
+                    "file":      str(tools.resolve(src.path)),
+                    "log":       self.source_log(tools, src),
+                    "arguments": ["clang", *self.source_incdirs(tools, src), *self.source_defines(tools, src), "-c", str(tools.resolve(src.path))],
+                }
+                for src in batch
+            ]
+
+            tools.log.info(f"Add check batch {name}.{index} for {len(batch)} C sources")
+
+            targets.append(Target(
+                name = f"ctidy-batch/{name}.{index}.log",
+                rule = self.rule_ctidy_batch,
+                deps = tuple(tools.resolve(src.path) for src in batch),
+
+                # The entries end in the response file, $ must be escaped for ninja
+                vars = TargetVars.from_args(
+                    entries = json.dumps(entries).replace("$", "$$")
+                )
+            ))
+
+        return tuple(targets)
+
+
     def process_component(self, tools: Toolchain, comp: Component):
         tools.log.info (f"Add check for C component: {comp.name}")
         tools.log.debug(f" -- Component path: {comp.path}")
 
-        targets_srcs       = tuple()
-        targets_comp       = tuple()
+        targets_srcs       = TargetGraph()
+        targets_comp       = TargetGraph()
         components_incdirs = set()
 
         # Process components deps.
-        for sub_comp in comp.components_dependencies:
-            components_incdirs.add(sub_comp.path.resolve())
+        for sub_comp in sorted(comp.components_dependencies, key=lambda x: x.name):
+            components_incdirs.add(tools.resolve(sub_comp.path))
             targets_comp += tools.process(sub_comp)
         components_incdirs = frozenset(components_incdirs)
 
         # Process sources
-        for src in comp.srcs:
+        srcs = []
+        for src in sorted(comp.srcs, key=lambda x: x.path):
             # Prepend path to sources paths, source path is relative to component path
-            src_path_prepend = Source(
+            srcs.append(Source(
                 path = comp.path / src.path,
                 lang = src.lang,
 
                 defines = src.defines.union(comp.defines),
 
                 incdirs_local = src.incdirs_local.union(frozenset({
-                    comp.path.resolve()
+                    tools.resolve(comp.path)
                 })),
 
-                incdirs_system = src.incdirs_system.union(components_incdirs).union(map(Path.resolve, comp.interface_directories))
-            )
+                incdirs_system = src.incdirs_system.union(components_incdirs).union(map(tools.resolve, comp.interface_directories))
+            ))
 
-            targets_srcs += tools.process(src_path_prepend)
+        if self.batch_size is None:
+            for src in srcs:
+                targets_srcs += tools.process(src)
+        else:
+            targets_srcs += self.process_batches(tools, f"{comp.path}/{comp.name}", srcs)
 
         # Add phony rule for component
         target_component = Target(
             name = f"ctidy-component/{comp.path}/{comp.name}.lock",
             rule = self.rule_touch_after,
-            deps = targets_srcs
+            deps = targets_srcs.freeze()
         )
 
-        return targets_comp + (target_component,)
+        return targets_comp.freeze() + (target_component,)
 
 
     def process_executable_static_lib(self, tools: Toolchain, exe: Executable):
         tools.log.info(f"Add check for C executable/static lib: {exe.name}")
 
-        targets = tuple()
+        targets = TargetGraph()
 
         # Process sources
-        for src in exe.srcs:
-            targets += tools.process(src)
+        srcs = sorted(exe.srcs, key=lambda x: x.path)
+        if self.batch_size is None:
+            for src in srcs:
+                targets += tools.process(src)
+        else:
+            targets += self.process_batches(tools, f"binlib/{exe.name}", srcs)
 
         # Process components
-        for comp in exe.components:
+        for comp in sorted(exe.components, key=lambda x: x.name):
             targets += tools.process(comp)
 
         # Add phony rule for component
         target_exe = Target(
             name = f"ctidy-binlib/{exe.name}.lock",
             rule = self.rule_touch_after,
-            deps = targets
+            deps = targets.freeze()
         )
         
         return (target_exe,)
@@ -0,0 +1,136 @@
+"""
+=====================================================
+clang-tidy batch driver, run by the ctidy_batch rule
+=====================================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Usage: python batch.py OUT RSPFILE -- clang-tidy [OPTIONS...]
+
+RSPFILE is a JSON list of {"file", "log", "arguments"} entries, one per
+source of the batch. The driver writes the compilation database of the batch
+in OUT.compdb/, runs a single clang-tidy process on the sources that are out
+of date, splits its output into one log per source, and writes OUT as the
+concatenation of the logs of the batch.
+
+A source is out of date if its log is missing or older than the source, or
+if its compile arguments changed since the last run (recorded in OUT.state),
+which matches the behaviour of one ctidy edge per source.
+
+This script only depends on the standard library, as it runs from ninja.
+"""
+
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+
+from pathlib import Path
+
+# Start of a diagnostic, notes are attached to the previous one
+DIAG_RE = re.compile(r"^(?P<path>[^\s:][^:]*):\d+:\d+: (?:warning|error|fatal error):")
+
+
+def write_if_changed(path: Path, content: str):
+    try:
+        if path.read_text() == content:
+            return
+    except OSError:
+        pass
+
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(content)
+    os.replace(tmp, path)
+
+
+def entry_digest(entry) -> str:
+    return hashlib.sha256(json.dumps([entry["file"], entry["arguments"]]).encode()).hexdigest()
+
+
+def is_stale(entry, state) -> bool:
+    if state.get(entry["file"]) != entry_digest(entry):
+        return True
+
+    try:
+        return os.stat(entry["file"]).st_mtime_ns > os.stat(entry["log"]).st_mtime_ns
+    except OSError:
+        return True
+
+
+def split_output(text: str, files):
+    """
+    Splits clang-tidy output into the diagnostics of each file. Diagnostics
+    located in other files (headers) go to the first file.
+    """
+
+    logs    = {x: [] for x in files}
+    by_path = {os.path.realpath(x): x for x in files}
+    current = files[0]
+
+    for line in text.splitlines(keepends=True):
+        m = DIAG_RE.match(line)
+        if m:
+            current = by_path.get(os.path.realpath(m.group("path")), files[0])
+        logs[current].append(line)
+
+    return {x: "".join(lines) for x, lines in logs.items()}
+
+
+def main(argv) -> int:
+    if len(argv) < 4 or argv[2] != "--":
+        print(__doc__, file=sys.stderr)
+        return 2
+
+    out     = Path(argv[0])
+    entries = json.loads(Path(argv[1]).read_text())
+    command = argv[3:]
+
+    state_path  = out.with_name(out.name + ".state")
+    compdb_dir  = out.with_name(out.name + ".compdb")
+
+    try:
+        state = json.loads(state_path.read_text())
+    except (OSError, ValueError):
+        state = dict()
+
+    # Compilation database of the batch
+    compdb_dir.mkdir(parents=True, exist_ok=True)
+    cwd = os.getcwd()
+    write_if_changed(compdb_dir / "compile_commands.json", json.dumps([
+        {"directory": cwd, "file": x["file"], "arguments": x["arguments"]}
+        for x in entries
+    ], indent=2) + "\n")
+
+    # Check out of date sources with a single process
+    stale = [x for x in entries if is_stale(x, state)]
+    if stale:
+        files  = [x["file"] for x in stale]
+        result = subprocess.run(
+            command + ["-p", str(compdb_dir)] + files,
+            stdout=subprocess.PIPE, universal_newlines=True
+        )
+
+        for entry, text in zip(stale, split_output(result.stdout, files).values()):
+            log = Path(entry["log"])
+            log.parent.mkdir(parents=True, exist_ok=True)
+            log.write_text(text)
+
+    # Batch log, and state for the next run
+    logs = []
+    for entry in entries:
+        try:
+            logs.append(Path(entry["log"]).read_text())
+        except OSError:
+            pass
+
+    write_if_changed(out, "".join(logs))
+    write_if_changed(state_path, json.dumps({x["file"]: entry_digest(x) for x in entries}, indent=2) + "\n")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
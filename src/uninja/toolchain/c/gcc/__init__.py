@@ -7,14 +7,19 @@ GCC Toolchain definition
 :Date: July 2023
 """
 
-from dataclasses           import dataclass
-from typing                import Optional, Tuple
+import fnmatch
+import os
+import zlib
+
+from dataclasses           import dataclass, replace
+from typing                import List, Optional, Tuple
 from pathlib               import Path
 
 from uninja.codebase.c     import Source, SourceLang, Component, Executable
 from uninja.toolchain.base import Toolchain
 
-from uninja                import  Target, TargetVars, Rule
+from uninja                import  Target, TargetVars, TargetGraph, Rule, Pool
+from uninja.rule           import replace_if_changed
 
 @dataclass
 class ToolchainGCC:
@@ -23,7 +28,49 @@ class ToolchainGCC:
 
     cflags: Tuple[str]     = tuple()
 
+    # ninja deps mode for compiled objects. With "gcc", ninja reads the
+    # depfiles once and keeps them in its .ninja_deps log. None to keep
+    # the .d files around.
+    deps: Optional[str]    = "gcc"
+
+    # Link and archive targets with at least this number of inputs pass them
+    # through a response file, to avoid hitting the command line length
+    # limit. 0 to always use response files, None to never use them.
+    rspfile_min_inputs: Optional[int] = 64
+
+    # Pools for compile and link jobs, for instance Pool("link", 2) to
+    # limit the memory used by concurrent links.
+    pool_cc: Optional[Pool] = None
+    pool_ld: Optional[Pool] = None
+
+    # Use the precompiled header of components (Component.pch). The header is
+    # precompiled with the flags of the largest group of sources of the
+    # component sharing the same flags, and only used by these sources.
+    # With ccache as launcher, its sloppiness setting must include
+    # pch_defines and time_macros for the objects using the header to be
+    # cached (see the ccache manual); pch_external_checksum also avoids
+    # hashing the whole .gch files.
+    pch: bool = True
+
+    # Unity build: sources of a component compiled with the same flags are
+    # compiled by batches of unity_size sources on average, through generated
+    # files including them. None to compile each source on its own. Sources
+    # matching one of the unity_exclude patterns (relative to the component
+    # path) are always compiled on their own.
+    unity_size: Optional[int]   = None
+    unity_exclude: Tuple[str]   = tuple()
+
+    # Compiler launcher, for instance ("ccache",), prepended to compile commands.
+    # With cache_friendly, compile commands use -fdebug-prefix-map and paths
+    # relative to the build directory for files under root_dir, so that they
+    # do not depend on where the project is checked out.
+    launcher: Tuple[str]        = tuple()
+    cache_friendly: bool        = True
+
     def __post_init__(self):
+        if self.unity_size is not None and self.unity_size < 1:
+            raise ValueError(f"Invalid unity batch size: {self.unity_size}")
+
         # Build prefix
         self.prefix = ""
         if self.path is not None:
@@ -32,27 +79,266 @@ class ToolchainGCC:
             self.prefix += str(self.variant) + "-"
 
 
+        # Launcher prefix
+        self.launcher_prefix = "".join(f"{x} " for x in self.launcher)
+        prefix_map           = "$prefix_map " if self.launcher and self.cache_friendly else ""
+
         # Init. Rules
         self.rule_cc = Rule(
             name        = f"cc-{self.variant or 'gcc'}",
             description = "Building $in...",
-            command     = f"{self.prefix}gcc -fdiagnostics-color=always -MMD -MF $out.d {' '.join(self.cflags)} $defines $incdirs -c $in -o $out",
-            depfile     = "$out.d"
+            command     = f"{self.launcher_prefix}{self.prefix}gcc -fdiagnostics-color=always -MMD -MF $out.d {' '.join(self.cflags)} {prefix_map}$pch $defines $incdirs -c $in -o $out",
+            depfile     = "$out.d",
+            deps        = self.deps,
+            pool        = self.pool_cc,
+            compile     = True
+        )
+
+        # Precompiled headers, with the same flags as the objects using them,
+        # including the prefix map: gcc rejects a header precompiled with another
+        # one. The header is included from a wrapper, as gcc < 14 warns about
+        # #pragma once in the main file.
+        self.rule_pch = Rule(
+            name        = f"pch-{self.variant or 'gcc'}",
+            description = "Precompiling $in...",
+            command     = f"printf '#include \"%s\"\\n' $in > $out.h && {self.launcher_prefix}{self.prefix}gcc -fdiagnostics-color=always -MMD -MF $out.d {' '.join(self.cflags)} {prefix_map}$defines $incdirs -x c-header -c $out.h -o $out",
+            depfile     = "$out.d",
+            deps        = self.deps,
+            pool        = self.pool_cc
         )
 
         self.rule_ld = Rule(
             name        = f"ld-{self.variant or 'gcc'}",
             description = "Linking $out",
-            command     = f"{self.prefix}gcc -o $out $in"
+            command     = f"{self.prefix}gcc -o $out $in",
+            pool        = self.pool_ld
+        )
+
+        # Archives are created in deterministic mode (no timestamps, uid or gid),
+        # and only replaced if their content changed, so that executables
+        # are not linked again if the archive is the same.
+        # Unity files only depend on the list of sources, given in the command:
+        # ninja writes them again when the list changes, and they are only
+        # replaced if their content changed.
+        self.rule_unity = Rule(
+            name        = f"unity-{self.variant or 'gcc'}",
+            description = "Generating $out",
+            command     = f"printf '#include \"%s\"\\n' $srcs > $out.tmp && {replace_if_changed()}",
+            restat      = True,
+            unity       = True
         )
 
         self.rule_lib = Rule(
             name        = f"lib-{self.variant or 'gcc'}",
             description = "Creating static lib $out",
-            command     = "ar rcs $out $in"
+            command     = f"rm -f $out.tmp && ar rcsD $out.tmp $in && {replace_if_changed()}",
+            restat      = True
+        )
+
+        # Same rules, using a response file for inputs
+        self.rule_ld_rsp = Rule(
+            name            = f"ld-{self.variant or 'gcc'}-rsp",
+            description     = "Linking $out",
+            command         = f"{self.prefix}gcc -o $out @$out.rsp",
+            rspfile         = "$out.rsp",
+            rspfile_content = "$in",
+            pool            = self.pool_ld
+        )
+
+        self.rule_lib_rsp = Rule(
+            name            = f"lib-{self.variant or 'gcc'}-rsp",
+            description     = "Creating static lib $out",
+            command         = f"rm -f $out.tmp && ar rcsD $out.tmp @$out.rsp && {replace_if_changed()}",
+            rspfile         = "$out.rsp",
+            rspfile_content = "$in",
+            restat          = True
+        )
+
+
+    def rule_for_inputs(self, rule: Rule, rule_rsp: Rule, deps: Tuple[Target]) -> Rule:
+        """
+        Selects the response file variant of a rule if the target has many inputs
+        """
+
+        if self.rspfile_min_inputs is not None and len(deps) >= self.rspfile_min_inputs:
+            return rule_rsp
+        return rule
+
+
+    def source_path(self, tools: Toolchain, path: Path) -> str:
+        """
+        Path of a source file or include directory in compile commands. With a
+        cache friendly launcher, paths under root_dir are relative to the build
+        directory, where ninja runs.
+        """
+
+        resolved = tools.resolve(path)
+        if self.launcher and self.cache_friendly and resolved.is_relative_to(tools.resolve(tools.root_dir)):
+            return os.path.relpath(resolved, tools.resolve(tools.build_dir))
+        return str(resolved)
+
+
+    def source_vars(self, tools: Toolchain, src: Source) -> TargetVars:
+        if self.launcher and self.cache_friendly:
+            incdir     = lambda x: self.source_path(tools, x)
+            prefix_map = {"prefix_map": f"-fdebug-prefix-map={tools.resolve(tools.root_dir)}=."}
+        else:
+            incdir     = str
+            prefix_map = {}
+
+        # FIXME # No escaping for defines, can cause some bugs?
+        return TargetVars.from_args(
+            incdirs = f"-iquote {self.source_path(tools, src.path.parent)}" \
+                + "".join(map(lambda x: f" -iquote {incdir(x)}", sorted(src.incdirs_local, key=str))) \
+                + "".join(map(lambda x: f" -I {incdir(x)}", sorted(src.incdirs_system, key=str))),
+
+            defines = " ".join(map(lambda x: f"-D{x.name}" + (f"={x.value}" if x.value is not None else ""), sorted(src.defines, key=lambda x: x.name))),
+
+            **prefix_map
+        )
+
+
+    def with_pch(self, tools: Toolchain, target: Target, target_pch: Target, flags: str) -> Target:
+        """
+        Makes the object target use the precompiled header, with the given
+        flags, if it is compiled with the same flags as the header: include
+        directories, defines and other variables. Otherwise, the target is
+        returned as is, and the header is parsed as usual.
+        """
+
+        if target.vars != target_pch.vars:
+            tools.log.debug(f" -- Not using precompiled header for {target.name}: flags differ")
+            return target
+
+        return replace(target,
+            vars     = target.vars.with_var("pch", flags),
+            implicit = tuple(target.implicit) + (target_pch,)
         )
 
 
+    def process_pch(self, tools: Toolchain, comp: Component, objs: List[Tuple[Source, Tuple[Target]]]):
+        """
+        Precompiles the header of the component with the flags of the largest
+        group of its objects compiled with the same flags (the first one in
+        source order for ties), and makes the objects of this group use it.
+        Other objects parse the header as usual. objs is as for process_unity().
+        """
+
+        groups = dict() # Object vars -> number of objects
+        for _, src_targets in objs:
+            for tt in src_targets:
+                if isinstance(tt, Target) and tt.rule == self.rule_cc:
+                    groups[tt.vars] = groups.get(tt.vars, 0) + 1
+
+        if not groups:
+            tools.log.warning(f"Precompiled header {comp.pch} of component {comp.name} is not used by any source")
+            return objs
+
+        pch_vars   = max(groups, key=groups.get)
+        target_pch = Target(
+            name = f"pch/{tools.relative(comp.path)}/{comp.pch}.gch",
+            rule = self.rule_pch,
+            deps = (tools.resolve(comp.path / comp.pch),),
+            vars = pch_vars
+        )
+
+        # gcc looks for the .gch in the pch directory first, and falls back to
+        # the header in the component directory if it is not valid. No
+        # -Winvalid-pch, which is an error with -Werror.
+        flags = f"-iquote pch/{tools.relative(comp.path)} -include {comp.pch}"
+
+        tools.log.debug(f" -- Precompiled header {comp.pch} used by {groups[pch_vars]} of {sum(groups.values())} objects")
+
+        return [
+            (src, tuple(
+                self.with_pch(tools, x, target_pch, flags) if isinstance(x, Target) and x.rule == self.rule_cc else x
+                for x in src_targets
+            ))
+            for src, src_targets in objs
+        ]
+
+
+    def store(self, tools: Toolchain, targets: Tuple[Target], nodes = tuple()) -> Tuple:
+        """
+        With a graph in tools (see Toolchain.graph), adds the targets to it,
+        releases the targets cached for the given processed nodes, and returns
+        views of the targets. Otherwise, returns the targets.
+        """
+
+        if tools.graph is None:
+            return tuple(targets)
+
+        views = tools.graph.add_targets(targets)
+        for x in nodes:
+            tools.cache_invalidate(x)
+
+        return views
+
+
+    def unity_batches(self, srcs):
+        """
+        Splits the sorted sources in batches. A batch ends after a source whose
+        path hash is a multiple of unity_size (or at twice this size), so
+        adding or removing a source only changes its own batch.
+        """
+
+        batch = []
+        for src in srcs:
+            batch.append(src)
+            if len(batch) >= 2 * self.unity_size or zlib.crc32(str(src.path).encode()) % self.unity_size == 0:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+
+    def process_unity(self, tools: Toolchain, comp: Component, objs: List[Tuple[Source, Tuple[Target]]]):
+        """
+        Replaces the objects of the component sources by unity objects.
+        objs gives, for each source (relative to the component path), the
+        targets built for it. Only objects compiled by rule_cc with the same
+        flags can be merged.
+        """
+
+        groups  = dict() # Flags -> [(src, target)]
+        targets = []
+
+        for src, src_targets in objs:
+            for tt in src_targets:
+                if src.lang == SourceLang.C \
+                    and isinstance(tt, Target) and tt.rule == self.rule_cc \
+                    and not any(fnmatch.fnmatch(str(src.path), x) for x in self.unity_exclude):
+                    groups.setdefault((tt.vars, tt.implicit), []).append((src, tt))
+                else:
+                    targets.append(tt)
+
+        for group in groups.values():
+            by_src = dict() # Source -> its first target
+            for src, tt in group:
+                by_src.setdefault(src, tt)
+
+            for batch in self.unity_batches(by_src):
+                first = by_src[batch[0]]
+                if len(batch) == 1:
+                    targets.append(first)
+                    continue
+
+                name        = f"unity/{tools.relative(comp.path)}/{comp.name}-{zlib.crc32(str(batch[0].path).encode()):08x}.c"
+                target_file = Target(
+                    name = name,
+                    rule = self.rule_unity,
+                    vars = TargetVars.from_args(
+                        srcs = " ".join(str(tools.resolve(comp.path / src.path)) for src in batch)
+                    )
+                )
+
+                tools.log.debug(f" -- Unity file {name} for {len(batch)} sources")
+                targets.append(replace(first, name=f"obj/{name}.o", deps=(target_file,)))
+
+        return targets
+
+
     ############################################
     # Processors
     ############################################
@@ -62,18 +348,10 @@ class ToolchainGCC:
         tools.log.debug(f" -- Source lang: {src.lang}")
 
         target = Target(
-            name = f"obj/{src.path.resolve().relative_to(tools.root_dir)}.o",
+            name = f"obj/{tools.relative(src.path)}.o",
             rule = self.rule_cc,
-            deps = (src.path.resolve(),),
-
-            # FIXME # No escaping for defines, can cause some bugs?
-            vars = TargetVars.from_args(
-                incdirs = f"-iquote {src.path.parent.resolve()}" \
-                    + "".join(map(lambda x: f" -iquote {x!s}", src.incdirs_local)) \
-                    + "".join(map(lambda x: f" -I {x!s}", src.incdirs_system)),
-
-                defines = " ".join(map(lambda x: f"-D{x.name}" + (f"={x.value}" if x.value is not None else ""), src.defines))
-            )
+            deps = (self.source_path(tools, src.path),),
+            vars = self.source_vars(tools, src)
         )
 
         return (target,)
@@ -83,18 +361,20 @@ class ToolchainGCC:
         tools.log.info(f"Add component: {comp.name}")
         tools.log.debug(f" -- Path: {comp.path}")
 
-        targets_srcs       = tuple()
-        targets_comp       = tuple()
+        targets_srcs       = TargetGraph()
+        targets_comp       = TargetGraph()
         components_incdirs = set()
 
         # Process component deps.
-        for sub_comp in comp.components_dependencies:
-            components_incdirs.add(sub_comp.path.resolve())
+        for sub_comp in sorted(comp.components_dependencies, key=lambda x: x.name):
+            components_incdirs.add(tools.resolve(sub_comp.path))
             targets_comp += tools.process(sub_comp)
         components_incdirs = frozenset(components_incdirs)
 
         # Process sources
-        for src in comp.srcs:
+        objs      = []
+        src_nodes = []
+        for src in sorted(comp.srcs, key=lambda x: x.path):
             # Prepend component path to sources path
             # -> Source path is relative to component path
             # in component definition
@@ -109,31 +389,43 @@ class ToolchainGCC:
                 incdirs_system = src.incdirs_system.union(components_incdirs)
             )
 
-            targets_srcs += tools.process(src_path_prepend)
+            objs.append((src, tools.process(src_path_prepend)))
+            src_nodes.append(src_path_prepend)
+
+        if self.pch and comp.pch is not None:
+            objs = self.process_pch(tools, comp, objs)
+
+        if self.unity_size is not None:
+            targets_srcs += self.process_unity(tools, comp, objs)
+        else:
+            for _, targets in objs:
+                targets_srcs += targets
 
         # Create static library target for component
+        deps_lib   = targets_srcs.freeze()
         target_lib = Target(
             name = f"component/{comp.name}.a",
-            rule = self.rule_lib,
-            deps = targets_srcs
+            rule = self.rule_for_inputs(self.rule_lib, self.rule_lib_rsp, deps_lib),
+            deps = deps_lib
         )
 
-        return (target_lib,) + targets_comp
+        return self.store(tools, (target_lib,), src_nodes) + targets_comp.freeze()
 
     def process_executable(self, tools: Toolchain, exe: Executable):
         tools.log.info(f"Add executable: {exe.name}")
 
-        targets            = tuple()
+        targets            = TargetGraph()
         components_incdirs = set()
 
         # Process component deps
-        for comp in exe.components:
+        for comp in sorted(exe.components, key=lambda x: x.name):
             targets += tools.process(comp)
-            components_incdirs.add(comp.path.resolve())
+            components_incdirs.add(tools.resolve(comp.path))
         components_incdirs = frozenset(components_incdirs)
 
         # Process sources
-        for src in exe.srcs:
+        src_nodes = []
+        for src in sorted(exe.srcs, key=lambda x: x.path):
             # Include component directories to sources
             src = Source(
                 path = src.path,
@@ -143,15 +435,17 @@ class ToolchainGCC:
             )
 
             targets += tools.process(src)
+            src_nodes.append(src)
 
         # Add executable target
+        deps_exe   = targets.freeze()
         target_exe = Target(
             name = exe.name,
-            rule = self.rule_ld,
-            deps = targets
+            rule = self.rule_for_inputs(self.rule_ld, self.rule_ld_rsp, deps_exe),
+            deps = deps_exe
         )
 
-        return (target_exe,)
+        return self.store(tools, (target_exe,), src_nodes)
 
     def associate_to(self, tools: Toolchain):
         tools.processor_register(Source,     self.process_source    )
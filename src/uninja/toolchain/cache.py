@@ -0,0 +1,374 @@
+"""
+=====================================================
+Persistent configure cache for processed codebase nodes
+=====================================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: - July 2023
+
+The cache stores, for each node processed by a toolchain, a fingerprint of the
+node and the targets it produced. The fingerprint covers the node content
+(including its sub-nodes), the toolchain settings and processors (so the rule
+definitions), and the root directory. On the next configure, the targets of
+unchanged nodes are loaded instead of being processed again.
+
+The library code building the targets (for instance the command helpers
+of uninja.rule) is not fingerprinted per node: instead, the cache file is
+ignored if the uninja sources changed.
+
+The filesystem is not part of the fingerprint: if a symbolic link used by
+the project changes, the cache file must be removed.
+"""
+
+import dataclasses
+import enum
+import hashlib
+import logging
+import pickle
+import sys
+import types
+
+from pathlib     import Path, PurePath
+from typing      import Dict, List, Optional, Tuple
+
+from ..          import Target
+from ..utils.fs  import write_if_changed
+
+# Bump when the fingerprint or file format changes
+CACHE_VERSION = 2
+
+log = logging.getLogger("uninja.cache")
+
+_package_digest = None
+
+
+def package_digest() -> str:
+    """
+    Digest of the sources of the uninja package, computed once per process.
+    """
+
+    global _package_digest
+
+    if _package_digest is None:
+        root = Path(__file__).resolve().parents[1]
+        h    = hashlib.sha256()
+        for path in sorted(root.rglob("*.py")):
+            h.update(path.relative_to(root).as_posix().encode() + b"\0")
+            h.update(hashlib.sha256(path.read_bytes()).digest())
+        _package_digest = h.hexdigest()
+
+    return _package_digest
+
+
+def _version():
+    return (CACHE_VERSION, sys.version_info[:2], package_digest())
+
+
+########################################################
+# Fingerprints
+########################################################
+
+class Fingerprinter:
+    """
+    Computes stable digests of codebase nodes, toolchain settings and processors.
+    Unlike hash(), the digest does not depend on the python process. Results
+    are memoized per object, so that nodes shared in the graph are only
+    walked once.
+    """
+
+    def __init__(self):
+        self._memo = dict() # id(obj) -> (obj, digest), obj is kept so that its id is not reused
+
+
+    def __call__(self, x) -> bytes:
+        try:
+            return self._memo[id(x)][1]
+        except KeyError:
+            pass
+
+        h = hashlib.sha256()
+        self._update(h, x)
+        digest = h.digest()
+
+        self._memo[id(x)] = (x, digest)
+        return digest
+
+
+    def _update(self, h, x):
+        if x is None or isinstance(x, (bool, int, float, str, bytes)):
+            h.update(f"V{type(x).__name__}:{x!r};".encode())
+
+        elif isinstance(x, PurePath):
+            h.update(f"P{x!s};".encode())
+
+        elif isinstance(x, enum.Enum):
+            h.update(f"E{type(x).__qualname__}.{x.name};".encode())
+
+        elif isinstance(x, (tuple, list)):
+            h.update(f"T{len(x)}:".encode())
+            for item in x:
+                h.update(self(item))
+
+        elif isinstance(x, (frozenset, set)):
+            h.update(f"S{len(x)}:".encode())
+            for digest in sorted(map(self, x)):
+                h.update(digest)
+
+        elif isinstance(x, dict):
+            h.update(f"D{len(x)}:".encode())
+            for digest in sorted(self(self(k) + self(v)) for k, v in x.items()):
+                h.update(digest)
+
+        elif isinstance(x, type):
+            h.update(f"K{x.__module__}.{x.__qualname__};".encode())
+
+        elif dataclasses.is_dataclass(x):
+            h.update(f"C{type(x).__module__}.{type(x).__qualname__}:".encode())
+            for f in dataclasses.fields(x):
+                h.update(f.name.encode())
+                h.update(self(getattr(x, f.name)))
+
+        elif isinstance(x, types.MethodType):
+            # The instance attributes are used by the processor, including the
+            # ones set in __post_init__, like rules. Private ones are caches.
+            obj = x.__self__
+            h.update(f"M{type(obj).__module__}.{type(obj).__qualname__}:".encode())
+            h.update(self({k: v for k, v in vars(obj).items() if not k.startswith("_")}))
+
+            # Other methods of the instance may be called by the processor
+            for cls in type(x.__self__).__mro__[:-1]:
+                for name, value in sorted(vars(cls).items()):
+                    if isinstance(value, types.FunctionType):
+                        h.update(self(value))
+
+        elif isinstance(x, types.FunctionType):
+            h.update(f"F{x.__module__}.{x.__qualname__}:".encode())
+            h.update(self(x.__code__))
+            h.update(self(x.__defaults__))
+            h.update(self(tuple(c.cell_contents for c in (x.__closure__ or ()))))
+
+            # Global values used by the function, like rules. Referenced
+            # functions, classes and modules are not followed.
+            for name in x.__code__.co_names:
+                value = x.__globals__.get(name, None)
+                if value is None or callable(value) or isinstance(value, types.ModuleType):
+                    continue
+                try:
+                    digest = self(value)
+                except TypeError:
+                    continue
+                h.update(name.encode())
+                h.update(digest)
+
+        elif isinstance(x, types.CodeType):
+            h.update(b"O")
+            h.update(x.co_code)
+            h.update(self(x.co_names))
+            h.update(self(x.co_consts))
+
+        else:
+            raise TypeError(f"Cannot fingerprint object of type {type(x)}")
+
+
+########################################################
+# Cache
+########################################################
+
+@dataclasses.dataclass
+class _Entry:
+    targets: Tuple[Target]
+    children: Tuple[bytes] # Keys of the nodes processed to produce the targets
+
+
+class ConfigureCache:
+    """
+    On-disk cache of the targets produced by Toolchain.process, to be given
+    as the configure_cache of a Toolchain. Call save() at the end of the
+    configure step.
+
+    reused and recomputed list the nodes that were loaded from the cache,
+    and the nodes that were processed again.
+    """
+
+    def __init__(self, path: Path):
+        self.path        = Path(path)
+
+        self.reused      = []
+        self.recomputed  = []
+
+        self._fp         = Fingerprinter()
+        self._entries    = None    # Loaded entries
+        self._new        = dict()  # Entries produced by this configure
+        self._used       = set()   # Keys of loaded entries reused in this configure
+        self._stack      = []      # Keys of nodes being processed, with their children keys
+
+
+    def load(self):
+        self._entries = dict()
+
+        try:
+            with open(self.path, "rb") as fhandle:
+                data = pickle.load(fhandle)
+        except FileNotFoundError:
+            return
+        except Exception as exc:
+            log.warning(f"Ignoring unreadable configure cache {self.path}: {exc}")
+            return
+
+        if not isinstance(data, dict) or data.get("version") != _version():
+            log.info(f"Ignoring configure cache {self.path} from another version")
+            return
+
+        # Objects of classes changed since the cache was written lack fields
+        try:
+            _check_layout(data["entries"])
+        except (AttributeError, TypeError) as exc:
+            log.info(f"Ignoring configure cache {self.path} with outdated objects: {exc}")
+            return
+
+        self._entries = data["entries"]
+
+
+    def save(self):
+        """
+        Writes the cache file, keeping only the entries used by this configure.
+        The file is left untouched if no entry was added or dropped: pickled
+        sets are not in a stable order, so the same entries may not give the
+        same bytes.
+        """
+
+        entries = dict(self._new)
+        loaded  = self._entries or dict()
+
+        todo = list(self._used)
+        while todo:
+            key = todo.pop()
+            if key not in entries and key in loaded:
+                entries[key] = loaded[key]
+                todo.extend(entries[key].children)
+
+        if not self._new and entries.keys() == loaded.keys():
+            log.info(f"Configure cache: {len(self.reused)} nodes reused, up to date")
+            return
+
+        try:
+            data = pickle.dumps({
+                "version": _version(),
+                "entries": entries
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError, TypeError) as exc:
+            log.warning(f"Cannot save configure cache {self.path}: {exc}")
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_if_changed(self.path, (data,))
+
+        log.info(f"Configure cache: {len(self.reused)} nodes reused, {len(self.recomputed)} recomputed")
+        for node in self.recomputed:
+            log.debug(f" -- Recomputed: {_node_name(node)}")
+
+
+    def key(self, tools, x) -> Optional[bytes]:
+        """
+        Cache key for node x processed by tools, None if x cannot be fingerprinted.
+        """
+
+        try:
+            return hashlib.sha256(tools.fingerprint(self._fp) + self._fp(x)).digest()
+        except TypeError:
+            return None
+
+
+    def link(self, key: Optional[bytes]):
+        """
+        Records that the node being processed uses the node with given key.
+        """
+
+        if key is not None and self._stack:
+            self._stack[-1][1].append(key)
+
+
+    def fork(self):
+        """
+        Called in a worker process holding a copy of the cache: the entries
+        known so far are kept for lookups, and the worker then only collects
+        its own changes, see delta().
+        """
+
+        self._entries    = {**(self._entries or dict()), **self._new}
+        self._new        = dict()
+        self._used       = set()
+        self.reused      = []
+        self.recomputed  = []
+
+
+    def delta(self):
+        return (self._new, self._used, self.reused, self.recomputed)
+
+
+    def merge(self, delta):
+        """
+        Merges the changes made by a worker process, from its delta().
+        """
+
+        new, used, reused, recomputed = delta
+
+        self._new.update(new)
+        self._used.update(used)
+        self.reused.extend(reused)
+        self.recomputed.extend(recomputed)
+
+
+    def process(self, tools, x, processor) -> Tuple[Target]:
+        if self._entries is None:
+            self.load()
+
+        key = self.key(tools, x)
+        self.link(key)
+
+        if key is None:
+            return tuple(processor(tools, x))
+
+        entry = self._new.get(key) or self._entries.get(key)
+        if entry is not None:
+            self._used.add(key)
+            self.reused.append(x)
+            return entry.targets
+
+        self._stack.append((key, []))
+        try:
+            targets = tuple(processor(tools, x))
+        finally:
+            _, children = self._stack.pop()
+
+        self._new[key] = _Entry(targets=targets, children=tuple(children))
+        self.recomputed.append(x)
+
+        return targets
+
+
+def _check_layout(entries):
+    """
+    Walks the loaded entries, and raises AttributeError if a dataclass
+    instance lacks one of the fields of its class.
+    """
+
+    seen = set()
+    todo = [(x.targets, x.children) for x in entries.values()]
+    while todo:
+        x = todo.pop()
+        if id(x) in seen:
+            continue
+        seen.add(id(x))
+
+        if isinstance(x, (tuple, list, frozenset, set)):
+            todo.extend(x)
+        elif isinstance(x, dict):
+            todo.extend(x.keys())
+            todo.extend(x.values())
+        elif dataclasses.is_dataclass(x) and not isinstance(x, type):
+            todo.extend(getattr(x, f.name) for f in dataclasses.fields(x))
+
+
+def _node_name(x):
+    return getattr(x, "name", None) or getattr(x, "path", None) or type(x).__name__
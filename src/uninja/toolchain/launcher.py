@@ -0,0 +1,115 @@
+"""
+============================================
+Compiler launcher (compiler cache) statistics
+============================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+
+Helpers to report the hit rate of the compiler cache given as launcher to
+the toolchains, for instance in CI:
+
+    python -m uninja.toolchain.launcher --zero ccache
+    ninja
+    python -m uninja.toolchain.launcher ccache
+
+ccache and sccache are supported.
+"""
+
+import json
+import logging
+import subprocess
+import sys
+
+from dataclasses import dataclass
+from pathlib     import PurePath
+from typing      import Sequence
+
+log = logging.getLogger("uninja.launcher")
+
+
+@dataclass(eq=True, frozen=True)
+class CacheStats:
+    hits: int
+    misses: int
+
+    @property
+    def total(self) -> int:
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.total if self.total else 0.0
+
+    def __str__(self):
+        return f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.1%} hit rate)"
+
+
+def _kind(launcher: Sequence[str]) -> str:
+    name = PurePath(launcher[-1]).name
+    if name not in ("ccache", "sccache"):
+        raise ValueError(f"Unsupported launcher for statistics: {name}")
+    return name
+
+
+def cache_stats(launcher: Sequence[str] = ("ccache",)) -> CacheStats:
+    """
+    Returns the statistics of the launcher cache, since the last cache_zero_stats().
+    """
+
+    launcher = tuple(launcher)
+    kind     = _kind(launcher)
+
+    if kind == "ccache":
+        out    = subprocess.run(launcher + ("--print-stats",), check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        values = dict()
+        for line in out.splitlines():
+            key, _, value = line.partition("\t")
+            if value.strip().isdigit():
+                values[key] = int(value)
+
+        return CacheStats(
+            hits   = values.get("direct_cache_hit", 0) + values.get("preprocessed_cache_hit", 0),
+            misses = values.get("cache_miss", 0)
+        )
+
+    else:
+        out   = subprocess.run(launcher + ("--show-stats", "--stats-format", "json"), check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        stats = json.loads(out)["stats"]
+
+        return CacheStats(
+            hits   = sum(stats.get("cache_hits",   {}).get("counts", {}).values()),
+            misses = sum(stats.get("cache_misses", {}).get("counts", {}).values())
+        )
+
+
+def cache_zero_stats(launcher: Sequence[str] = ("ccache",)):
+    """
+    Resets the statistics of the launcher cache, before a build.
+    """
+
+    launcher = tuple(launcher)
+    _kind(launcher) # Same option for ccache and sccache
+    subprocess.run(launcher + ("--zero-stats",), check=True, stdout=subprocess.DEVNULL)
+
+
+def report(launcher: Sequence[str] = ("ccache",)) -> CacheStats:
+    """
+    Logs the statistics of the launcher cache, and returns them.
+    """
+
+    stats = cache_stats(launcher)
+    log.info(f"Compiler cache {' '.join(launcher)}: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    args     = sys.argv[1:]
+    zero     = "--zero" in args
+    launcher = tuple(x for x in args if x != "--zero") or ("ccache",)
+
+    if zero:
+        cache_zero_stats(launcher)
+    else:
+        stats = cache_stats(launcher)
+        print(f"hits={stats.hits} misses={stats.misses} hit_rate={stats.hit_rate:.3f}")
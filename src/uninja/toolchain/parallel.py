@@ -0,0 +1,199 @@
+"""
+=================================================
+Parallel processing of codebase nodes by a pool
+=================================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: - July 2023
+
+Nodes given to Toolchain.process_many are grouped by levels: a node goes to
+the level after the other given nodes it contains. Each level is processed by
+a new pool of forked worker processes, which inherit the targets of previous
+levels through the toolchain memo cache, so that no node is processed twice.
+"""
+
+import dataclasses
+import gc
+import io
+import multiprocessing
+import pickle
+
+from concurrent.futures import ProcessPoolExecutor
+from typing             import Dict, List, Sequence, Tuple
+
+from ..                 import Target
+
+
+# Toolchain used by the worker processes, and targets known by the parent
+# process (by id), inherited when forking
+_tools = None
+_known = None
+
+
+def levels(nodes: Sequence[any]) -> List[List[any]]:
+    """
+    Groups the given nodes by levels, so that each node comes after the
+    other given nodes it contains (through its dataclass fields).
+    """
+
+    nodes   = tuple(dict.fromkeys(nodes))
+    given   = set(nodes)
+    level   = dict()
+
+    # Iterative post-order walk of the node graph, where only the given nodes
+    # have a level. Other nodes (like sources) transmit the level of their content.
+    depth   = dict()
+    for root in nodes:
+        stack = [(root, False)]
+        while stack:
+            x, expanded = stack.pop()
+            if id(x) in depth:
+                continue
+
+            children = _children(x)
+            if not expanded:
+                stack.append((x, True))
+                stack.extend((ch, False) for ch in children if id(ch) not in depth)
+                continue
+
+            d = max((depth[id(ch)] for ch in children), default=-1)
+            if x in given:
+                level[x] = d + 1
+                d        = d + 1
+            depth[id(x)] = d
+
+    result = [[] for _ in range(max(level.values(), default=-1) + 1)]
+    for x in nodes:
+        result[level[x]].append(x)
+
+    return result
+
+
+def _children(x):
+    if not dataclasses.is_dataclass(x):
+        return tuple()
+
+    children = []
+    for f in dataclasses.fields(x):
+        value = getattr(x, f.name)
+        if isinstance(value, (frozenset, tuple, list)):
+            children.extend(ch for ch in value if dataclasses.is_dataclass(ch))
+        elif dataclasses.is_dataclass(value):
+            children.append(value)
+
+    return children
+
+
+def process_many(tools, nodes: Sequence[any], workers: int) -> Dict[any, Tuple[Target]]:
+    """
+    Processes nodes with the given toolchain in a pool of worker processes.
+    Returns the targets of each node.
+    """
+
+    global _tools, _known
+
+    results = dict()
+    cache   = tools.configure_cache
+
+    # Load the configure cache now so that the workers inherit it
+    if cache is not None and cache._entries is None:
+        cache.load()
+
+    # Targets the workers inherit from this process, by id. As forked workers
+    # have the same objects at the same addresses, they only send back new
+    # targets, and references to the known ones.
+    known = dict()
+    for tt in tools._cache.values():
+        _add_known(known, tt)
+
+    for level_nodes in levels(nodes):
+        # Not worth forking
+        if len(level_nodes) < 2:
+            for x in level_nodes:
+                results[x] = tools.process(x)
+                _add_known(known, results[x])
+            continue
+
+        # A few chunks for each worker, to balance load
+        nchunks = min(len(level_nodes), workers * 4)
+        chunks  = [level_nodes[i::nchunks] for i in range(nchunks)]
+
+        _tools, _known = tools, known
+
+        # Keep the garbage collector of workers away from inherited objects,
+        # so that their memory pages are not copied for nothing.
+        gc.freeze()
+        try:
+            with ProcessPoolExecutor(
+                max_workers = min(workers, nchunks),
+                mp_context  = multiprocessing.get_context("fork")
+            ) as pool:
+                chunk_results = list(pool.map(_worker_process, chunks))
+        finally:
+            gc.unfreeze()
+            _tools, _known = None, None
+
+        # Merge results in the parent toolchain
+        for chunk, data in zip(chunks, chunk_results):
+            targets, hits, misses, delta = _Unpickler(io.BytesIO(data), known).load()
+
+            tools.cache_hits   += hits
+            tools.cache_misses += misses
+            if cache is not None:
+                cache.merge(delta)
+
+            for x, tt in zip(chunk, targets):
+                results[x] = tt
+                _add_known(known, tt)
+                if tools.memoize:
+                    tools._cache[x] = tt
+
+    return results
+
+
+def _add_known(known, targets):
+    """
+    Adds the targets and the targets they depend on to known
+    """
+
+    stack = list(targets)
+    while stack:
+        tt = stack.pop()
+        if isinstance(tt, Target) and id(tt) not in known:
+            known[id(tt)] = tt
+            stack.extend(tt.deps)
+            stack.extend(tt.implicit)
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, fhandle, known):
+        super().__init__(fhandle, protocol=pickle.HIGHEST_PROTOCOL)
+        self.known = known
+
+    def persistent_id(self, obj):
+        return id(obj) if (type(obj) is Target and id(obj) in self.known) else None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, fhandle, known):
+        super().__init__(fhandle)
+        self.known = known
+
+    def persistent_load(self, pid):
+        return self.known[pid]
+
+
+def _worker_process(chunk):
+    # Only report what is done for this chunk
+    _tools.cache_hits   = 0
+    _tools.cache_misses = 0
+    if _tools.configure_cache is not None:
+        _tools.configure_cache.fork()
+
+    targets = tuple(map(_tools.process, chunk))
+    delta   = _tools.configure_cache.delta() if _tools.configure_cache is not None else None
+
+    buf = io.BytesIO()
+    _Pickler(buf, _known).dump((targets, _tools.cache_hits, _tools.cache_misses, delta))
+
+    return buf.getvalue()
@@ -0,0 +1,88 @@
+"""
+=======================================
+Filesystem helpers for generated files
+=======================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+"""
+
+import filecmp
+import hashlib
+import os
+import tempfile
+import threading
+
+from dataclasses import dataclass
+from pathlib     import Path
+from typing      import Iterable, Union
+
+
+@dataclass(eq=True, frozen=True)
+class WriteResult:
+    path: Path
+    bytes_written: int # Size of the generated content
+    changed: bool      # False if the existing file was kept as is
+    digest: str        # SHA-256 hex digest of the generated content
+
+
+def write_if_changed(path: Path, chunks: Iterable[Union[str, bytes]], encoding: str = "utf-8") -> WriteResult:
+    """
+    Writes the given text (or bytes) chunks to a temporary file next to path. If the
+    resulting content is the same as the existing file, the existing file
+    is kept untouched (so is its mtime), else the temporary file is
+    atomically renamed to path.
+    """
+
+    path          = Path(path)
+    bytes_written = 0
+    h             = hashlib.sha256()
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fhandle:
+            for chunk in chunks:
+                data           = chunk if isinstance(chunk, bytes) else chunk.encode(encoding)
+                bytes_written += len(data)
+                h.update(data)
+                fhandle.write(data)
+
+        changed = not (path.is_file() and filecmp.cmp(tmp_path, path, shallow=False))
+
+        if changed:
+            # mkstemp creates files readable by the owner only
+            os.chmod(tmp_path, 0o666 & ~_umask())
+            os.replace(tmp_path, path)
+        else:
+            os.unlink(tmp_path)
+
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    return WriteResult(path=path, bytes_written=bytes_written, changed=changed, digest=h.hexdigest())
+
+
+_umask_lock  = threading.Lock()
+_umask_value = None
+
+
+def _umask():
+    """
+    Process umask, read once: os.umask can only be read by setting it, which
+    is not safe while other threads create files.
+    """
+
+    global _umask_value
+
+    with _umask_lock:
+        if _umask_value is None:
+            _umask_value = os.umask(0o077)
+            os.umask(_umask_value)
+
+    return _umask_value
+
+
+# Read at import, before write_sharded starts writer threads
+_umask()
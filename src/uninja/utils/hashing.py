@@ -0,0 +1,43 @@
+"""
+====================================================
+Hash caching for frozen dataclasses of the models
+====================================================
+
+:Authors: - Florian Dupeyron <florian.dupeyron@mugcat.fr>
+:Date: July 2023
+"""
+
+import functools
+
+
+def cached_hash(cls):
+    """
+    Class decorator for frozen dataclasses: the hash generated by the
+    dataclass is computed the first time it is needed, then kept in the
+    instance. Models nest frozensets of other models, so without this every
+    hash() walks the whole subtree.
+
+    Must be applied over the @dataclass decorator. The cached value is
+    not pickled, as string hashes are different between processes.
+    """
+
+    hash_fn = cls.__hash__
+
+    @functools.wraps(hash_fn)
+    def __hash__(self):
+        try:
+            return self.__dict__["_hash"]
+        except KeyError:
+            h = hash_fn(self)
+            object.__setattr__(self, "_hash", h)
+            return h
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_hash", None)
+        return state
+
+    cls.__hash__     = __hash__
+    cls.__getstate__ = __getstate__
+
+    return cls